@@ -0,0 +1,540 @@
+import os
+import re
+import math
+import h5py
+import numpy as np
+
+
+# rational approximation of the inverse normal CDF (P. J. Acklam), refined to
+# double precision with one Halley step in normPpf
+_ppfA = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_ppfB = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01)
+_ppfC = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_ppfD = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00)
+_ppfLow = 0.02425
+_erfc = np.vectorize(math.erfc, otypes=[float])
+
+# frames per slice when per-frame arrays are converted to a floatDtype other than float64
+floatDtypeSliceSize = 1 << 16
+
+
+def normPpf(p):
+    """Inverse of the standard normal CDF, matching scipy.stats.norm.ppf without importing scipy."""
+    p = np.asarray(p, dtype=float)
+    # work in the lower tail, where 1-p is exact and the normal CDF is accurate
+    q = np.minimum(p, 1 - p)
+    x = np.full(q.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tail = q < _ppfLow
+        t = np.sqrt(-2 * np.log(q[tail]))
+        x[tail] = np.polyval(_ppfC, t) / (np.polyval(_ppfD + (1,), t))
+        central = q >= _ppfLow
+        t = q[central] - 0.5
+        r = t * t
+        x[central] = np.polyval(_ppfA, r) * t / np.polyval(_ppfB + (1,), r)
+        e = 0.5 * _erfc(-x / math.sqrt(2)) - q
+        u = e * math.sqrt(2 * math.pi) * np.exp(x * x / 2)
+        refined = x - u / (1 + x * u / 2)
+        x = np.where(np.isfinite(refined), refined, x)
+    x = np.where(p > 0.5, -x, x)
+    x[p == 0] = -np.inf
+    x[p == 1] = np.inf
+    return x[()] if x.ndim == 0 else x
+
+
+def adjustResponseRate(r, n):
+    """Moves rates of 0 or 1 in by half a trial; works elementwise on arrays of rates and trial counts."""
+    r = np.asarray(r, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(r == 0, 0.5/np.asarray(n), np.where(r == 1, 1 - 0.5/np.asarray(n), r))
+    return r[()] if r.ndim == 0 else r
+
+
+def calcDprime(hitRate, falseAlarmRate, goTrials, nogoTrials):
+    hr = adjustResponseRate(hitRate, goTrials)
+    far = adjustResponseRate(falseAlarmRate, nogoTrials)
+    z = [normPpf(r) for r in (hr, far)]
+    return z[0]-z[1]
+
+
+def encodeStimuli(trialStim, blockStimRewarded):
+    """Encodes stimulus names as integer codes into one shared table of stimulus labels."""
+    stimLabels, stimCodes = np.unique(np.concatenate((trialStim, blockStimRewarded)), return_inverse=True)
+    return stimLabels, stimCodes[:len(trialStim)], stimCodes[len(trialStim):]
+
+
+def iterChunks(dataset, chunkSize, start=0, stop=None):
+    """Yields (start index, slice) for consecutive slices of at most chunkSize entries of an h5py dataset or array."""
+    stop = dataset.shape[0] if stop is None else stop
+    for i in range(start, stop, chunkSize):
+        yield i, dataset[i:min(i+chunkSize, stop)]
+
+
+class ChunkedFrameTimes():
+    """Frame times of a frameIntervals dataset read in fixed-size slices.
+
+    One streaming pass keeps the time of every chunkSize-th frame (and the
+    longest interval), so frame times at any frames can later be computed by
+    re-reading only the slices that contain them. Times match
+    np.concatenate(([0],np.cumsum(frameIntervals))) exactly.
+    """
+
+    def __init__(self, frameIntervals, chunkSize):
+        self.frameIntervals = frameIntervals
+        self.chunkSize = chunkSize
+        self.nFrames = frameIntervals.shape[0]
+        self.maxInterval = 0
+        chunkStartTimes = [0.]
+        for _, intervals in iterChunks(frameIntervals, chunkSize):
+            chunkStartTimes.append(self.cumulativeTimes(chunkStartTimes[-1], intervals)[-1])
+            self.maxInterval = max(self.maxInterval, intervals.max())
+        self.chunkStartTimes = np.array(chunkStartTimes)
+        self.duration = self.chunkStartTimes[-1]
+
+    @staticmethod
+    def cumulativeTimes(startTime, intervals):
+        # cumsum from the carried start time, so rounding matches one cumsum over all frames
+        return np.cumsum(np.concatenate(([startTime], intervals)))
+
+    def at(self, frames):
+        """Times of `frames`, indices into frame times (0 to nFrames)."""
+        frames = np.asarray(frames)
+        times = np.zeros(frames.shape)
+        chunks = frames // self.chunkSize
+        for chunk in np.unique(chunks):
+            inChunk = chunks == chunk
+            start = chunk * self.chunkSize
+            chunkTimes = self.cumulativeTimes(self.chunkStartTimes[chunk], self.frameIntervals[start:start+self.chunkSize])
+            times[inChunk] = chunkTimes[frames[inChunk] - start]
+        return times
+
+
+def calcFrameIntervalBins(maxInterval, frameRate):
+    return np.arange(-0.5/frameRate, maxInterval+1/frameRate, 1/frameRate)
+
+
+def calcBinMeans(values, binSize):
+    """nanmean of consecutive bins of binSize values, the last bin may be partial."""
+    nFull = values.size // binSize
+    means = np.nanmean(values[:nFull*binSize].reshape(nFull, binSize), axis=1)
+    if values.size > nFull*binSize:
+        means = np.append(means, np.nanmean(values[nFull*binSize:]))
+    return means
+
+
+class DynRoutData():
+    
+    def __init__(self):
+        self.frameRate = 60
+        self.engagedThresh = 10
+        self.runningSpeedBinSize = 60
+        self.chunkSize = None
+    
+    
+    def loadBehavData(self,filePath,chunkSize=None,floatDtype=np.float64):
+        """Loads a behavior file and computes trial types and block metrics.
+
+        If chunkSize is given, per-frame datasets (frameIntervals,
+        rotaryEncoderCount) and lickFrames are streamed in slices of chunkSize
+        entries, so peak memory does not grow with session length. In that
+        mode frameIntervals, frameTimes and runningSpeed are None and frame
+        times are only computed at event frames; the frame interval histogram
+        and binned running speed are computed in both modes. floatDtype sets
+        the dtype of stored per-frame arrays, e.g. np.float32; other dtypes
+        are filled a slice at a time, so loading never holds float64 copies.
+        """
+
+        self.behavDataPath = filePath
+        self.chunkSize = chunkSize
+        
+        d = h5py.File(self.behavDataPath,'r')
+        
+        # self.subjectName = d['subjectName'][()]
+        self.subjectName = re.search('.*_([0-9]{6})_',os.path.basename(self.behavDataPath)).group(1)
+        self.rigName = d['rigName'].asstr()[()]
+        self.computerName = d['computerName'].asstr()[()] if 'computerName' in d and  d['computerName'].dtype=='O' else None
+        self.taskVersion = d['taskVersion'].asstr()[()] if 'taskVersion' in d else None
+        self.startTime = d['startTime'].asstr()[()]
+        
+        self.nFrames = d['frameIntervals'].shape[0]
+        if chunkSize is None:
+            if np.dtype(floatDtype) == np.float64:
+                self.frameIntervals = d['frameIntervals'][:]
+                self.frameTimes = np.concatenate(([0],np.cumsum(self.frameIntervals)))
+            else:
+                # times are summed in float64 a slice at a time and stored as floatDtype, so no
+                # float64 copy of the session is held and times match the float64 cumsum
+                self.frameIntervals = np.empty(self.nFrames,dtype=floatDtype)
+                self.frameTimes = np.empty(self.nFrames+1,dtype=floatDtype)
+                self.frameTimes[0] = startTime = 0.
+                for i,intervals in iterChunks(d['frameIntervals'],floatDtypeSliceSize):
+                    times = ChunkedFrameTimes.cumulativeTimes(startTime,intervals)
+                    self.frameIntervals[i:i+intervals.size] = intervals
+                    self.frameTimes[i+1:i+1+intervals.size] = times[1:]
+                    startTime = times[-1]
+            getFrameTimes = lambda frames: self.frameTimes[frames]
+            maxFrameInterval = self.frameIntervals.max()
+            self.sessionDuration = self.frameTimes[-1]
+        else:
+            self.frameIntervals = None
+            self.frameTimes = None
+            chunkedFrameTimes = ChunkedFrameTimes(d['frameIntervals'],chunkSize)
+            getFrameTimes = chunkedFrameTimes.at
+            maxFrameInterval = chunkedFrameTimes.maxInterval
+            self.sessionDuration = chunkedFrameTimes.duration
+        
+        self.frameIntervalBins = calcFrameIntervalBins(maxFrameInterval,self.frameRate)
+        if chunkSize is None:
+            self.frameIntervalCounts = np.histogram(self.frameIntervals,bins=self.frameIntervalBins)[0]
+            self.longFrameCount = np.sum(self.frameIntervals > 1.5/self.frameRate)
+        else:
+            self.frameIntervalCounts = np.zeros(self.frameIntervalBins.size-1,dtype=int)
+            self.longFrameCount = 0
+            for _,intervals in iterChunks(d['frameIntervals'],chunkSize):
+                self.frameIntervalCounts += np.histogram(intervals,bins=self.frameIntervalBins)[0]
+                self.longFrameCount += np.sum(intervals > 1.5/self.frameRate)
+        
+        self.trialEndFrame = d['trialEndFrame'][:]
+        self.trialEndTimes = getFrameTimes(self.trialEndFrame)
+        self.nTrials = self.trialEndFrame.size
+        self.trialStartFrame = d['trialStartFrame'][:self.nTrials]
+        self.trialStartTimes = getFrameTimes(self.trialStartFrame)
+        self.stimStartFrame = d['trialStimStartFrame'][:self.nTrials]
+        self.stimStartTimes = getFrameTimes(self.stimStartFrame)
+        
+        self.newBlockAutoRewards = d['newBlockAutoRewards'][()]
+        self.newBlockGoTrials = d['newBlockGoTrials'][()]
+        self.newBlockNogoTrials = d['newBlockNogoTrials'][()] if 'newBlockNogoTrials' in d else 0
+        self.newBlockCatchTrials = d['newBlockCatchTrials'][()] if 'newBlockCatchTrials' in d else 0
+        self.autoRewardOnsetFrame = d['autoRewardOnsetFrame'][()]
+        
+        self.trialRepeat = d['trialRepeat'][:self.nTrials]
+        self.incorrectTrialRepeats = d['incorrectTrialRepeats'][()]
+        self.incorrectTimeoutFrames = d['incorrectTimeoutFrames'][()]
+        
+        self.quiescentFrames = d['quiescentFrames'][()]
+        self.quiescentViolationFrames = d['quiescentViolationFrames'][:] if 'quiescentViolationFrames' in d.keys() else d['quiescentMoveFrames'][:]    
+        self.quiescentViolationTimes = getFrameTimes(self.quiescentViolationFrames)
+        
+        self.responseWindow = d['responseWindow'][:]
+        self.responseWindowTime = np.array(self.responseWindow)/self.frameRate
+        
+        self.trialStim = d['trialStim'].asstr()[:self.nTrials]
+        self.trialBlock = d['trialBlock'][:self.nTrials]
+        self.blockTrial = np.concatenate([np.arange(np.sum(self.trialBlock==i)) for i in np.unique(self.trialBlock)])
+        self.blockStartTimes = self.trialStartTimes[[np.where(self.trialBlock==i)[0][0] for i in np.unique(self.trialBlock)]]
+        self.blockFirstStimTimes = self.stimStartTimes[[np.where(self.trialBlock==i)[0][0] for i in np.unique(self.trialBlock)]]
+        self.blockStimRewarded = d['blockStimRewarded'].asstr()[:]
+        self.rewardedStim = self.blockStimRewarded[self.trialBlock-1]
+        
+        # integer stimulus codes into stimLabels; per-label lookups replace per-trial string operations
+        self.stimLabels, self.trialStimCode, self.blockStimRewardedCode = encodeStimuli(self.trialStim, self.blockStimRewarded)
+        self.rewardedStimCode = self.blockStimRewardedCode[self.trialBlock-1]
+        self.stimModality = np.array([stim[:-1] for stim in self.stimLabels])
+        self.stimIdentity = np.array([stim[-1:] for stim in self.stimLabels])
+        self.stimModalityCode = np.unique(self.stimModality, return_inverse=True)[1]
+        
+        self.rewardFrames = d['rewardFrames'][:]
+        self.rewardTimes = getFrameTimes(self.rewardFrames)
+        self.rewardSize = d['rewardSize'][:]
+        self.trialResponse = d['trialResponse'][:self.nTrials]
+        self.trialResponseFrame = d['trialResponseFrame'][:self.nTrials]
+        self.trialRewarded = d['trialRewarded'][:self.nTrials]
+        
+        if 'trialAutoRewardScheduled' in d:
+            self.autoRewardScheduled = d['trialAutoRewardScheduled'][:self.nTrials]
+            self.autoRewarded = d['trialAutoRewarded'][:self.nTrials]
+            if len(self.autoRewardScheduled) < self.nTrials:
+                self.autoRewardScheduled = np.zeros(self.nTrials,dtype=bool)
+                self.autoRewardScheduled[self.blockTrial < self.newBlockAutoRewards] = True
+            if len(self.autoRewarded) < self.nTrials:
+                self.autoRewarded = self.autoRewardScheduled & np.in1d(self.stimStartFrame+self.autoRewardOnsetFrame,self.rewardFrames)
+        else:
+            self.autoRewardScheduled = d['trialAutoRewarded'][:self.nTrials]
+            self.autoRewarded = self.autoRewardScheduled & np.in1d(self.stimStartFrame+self.autoRewardOnsetFrame,self.rewardFrames)
+        self.rewardEarned = self.trialRewarded & (~self.autoRewarded)
+        
+        
+        self.responseTimes = np.full(self.nTrials,np.nan)
+        self.responseTimes[self.trialResponse] = getFrameTimes(self.trialResponseFrame[self.trialResponse].astype(int)) - self.stimStartTimes[self.trialResponse]
+        
+        if chunkSize is None:
+            self.lickFrames = d['lickFrames'][:]
+            if len(self.lickFrames) > 0:
+                lickTimesDetected = self.frameTimes[self.lickFrames]
+                self.minLickInterval = 0.05
+                isLick = np.concatenate(([True], np.diff(lickTimesDetected) > self.minLickInterval))
+                self.lickTimes = lickTimesDetected[isLick]
+            else:
+                self.lickTimes = np.array([])
+        else:
+            self.lickFrames = None
+            self.minLickInterval = 0.05
+            lickTimes = []
+            prevLickTime = -np.inf
+            for _,lickFrames in iterChunks(d['lickFrames'],chunkSize):
+                lickTimesDetected = getFrameTimes(lickFrames)
+                isLick = np.diff(np.concatenate(([prevLickTime],lickTimesDetected))) > self.minLickInterval
+                lickTimes.append(lickTimesDetected[isLick])
+                prevLickTime = lickTimesDetected[-1]
+            self.lickTimes = np.concatenate(lickTimes) if lickTimes else np.array([])
+        
+        self.runningSpeed = None
+        self.runningSpeedBinned = None
+        self.runningSpeedBinTimes = None
+        if 'rotaryEncoder' in d and isinstance(d['rotaryEncoder'][()],bytes) and d['rotaryEncoder'].asstr()[()] == 'digital':
+            countsToSpeed = 1 / d['rotaryEncoderCountsPerRev'][()] * 2 * np.pi * d['wheelRadius'][()] * self.frameRate
+            binSize = self.runningSpeedBinSize
+            # one speed per frame time, as in generate_running_speed_binned
+            nSpeed = min(d['rotaryEncoderCount'].shape[0],self.nFrames+1)
+            if chunkSize is None:
+                if np.dtype(floatDtype) == np.float64:
+                    self.runningSpeed = np.concatenate(([np.nan],np.diff(d['rotaryEncoderCount'][:]) * countsToSpeed))
+                else:
+                    nCounts = d['rotaryEncoderCount'].shape[0]
+                    self.runningSpeed = np.empty(nCounts,dtype=floatDtype)
+                    self.runningSpeed[:1] = np.nan
+                    for i in range(1,nCounts,floatDtypeSliceSize):
+                        counts = d['rotaryEncoderCount'][i-1:min(i+floatDtypeSliceSize,nCounts)]
+                        self.runningSpeed[i:i+counts.size-1] = np.diff(counts) * countsToSpeed
+                self.runningSpeedBinned = calcBinMeans(self.runningSpeed[:nSpeed],binSize)
+            else:
+                # slices hold whole bins, plus the previous count for the first difference
+                speedChunkSize = binSize * max(1,chunkSize // binSize)
+                binned = []
+                for i in range(0,nSpeed,speedChunkSize):
+                    speed = np.diff(d['rotaryEncoderCount'][max(i-1,0):min(i+speedChunkSize,nSpeed)]) * countsToSpeed
+                    if i == 0:
+                        speed = np.concatenate(([np.nan],speed))
+                    binned.append(calcBinMeans(speed,binSize))
+                self.runningSpeedBinned = np.concatenate(binned)
+            self.runningSpeedBinned = self.runningSpeedBinned.astype(floatDtype,copy=False)
+            binEndFrames = np.minimum(np.arange(0,nSpeed,binSize)+binSize,nSpeed)-1
+            self.runningSpeedBinTimes = getFrameTimes(binEndFrames)
+        
+        self.visContrast = d['visStimContrast'][()]
+        self.trialVisContrast = d['trialVisStimContrast'][:self.nTrials]
+        if 'gratingOri' in d:
+            self.gratingOri = {key: d['gratingOri'][key][()] for key in d['gratingOri']}
+        else:
+            self.gratingOri = {key: d['gratingOri_'+key][()] for key in ('vis1','vis2')}
+        self.trialGratingOri = d['trialGratingOri'][:self.nTrials]
+        
+        self.soundVolume = d['soundVolume'][()]
+        self.trialSoundVolume = d['trialSoundVolume'][:self.nTrials]
+        
+        if 'optoVoltage' in d:
+            self.optoVoltage = d['optoVoltage'][()]
+            self.galvoVoltage = d['galvoVoltage'][()]
+            self.trialOptoOnsetFrame = d['trialOptoOnsetFrame'][:self.nTrials]
+            self.trialOptoDur = d['trialOptoDur'][:self.nTrials]
+            self.trialOptoVoltage = d['trialOptoVoltage'][:self.nTrials]
+            self.trialGalvoVoltage = d['trialGalvoVoltage'][:self.nTrials]
+        if 'optoRegions' in d and len(d['optoRegions']) > 0:
+            self.optoRegions = d['optoRegions'].asstr()[()]
+            
+        d.close()
+        
+        self.catchTrials = (self.stimLabels == 'catch')[self.trialStimCode]
+        self.multimodalTrials = np.array(['+' in stim for stim in self.stimLabels],dtype=bool)[self.trialStimCode]
+        self.goTrials = (self.trialStimCode == self.rewardedStimCode) & (~self.autoRewardScheduled)
+        self.nogoTrials = (self.trialStimCode != self.rewardedStimCode) & (~self.catchTrials) & (~self.multimodalTrials)
+        self.sameModalNogoTrials = self.nogoTrials & (self.stimModalityCode[self.trialStimCode] == self.stimModalityCode[self.rewardedStimCode])
+        if 'distract' in self.taskVersion:
+            otherModalGoStim = np.isin(self.stimLabels,('vis1','sound1'))
+        else:
+            otherModalGoStim = np.zeros(self.stimLabels.size,dtype=bool)
+            otherModalGoStim[self.blockStimRewardedCode] = True
+        self.otherModalGoTrials = self.nogoTrials & otherModalGoStim[self.trialStimCode]
+        self.otherModalNogoTrials = self.nogoTrials & ~self.sameModalNogoTrials & ~self.otherModalGoTrials
+        
+        self.hitTrials = self.goTrials & self.trialResponse
+        self.missTrials = self.goTrials & (~self.trialResponse)
+        self.falseAlarmTrials =self. nogoTrials & self.trialResponse
+        self.correctRejectTrials = self.nogoTrials & (~self.trialResponse)
+        self.catchResponseTrials = self.catchTrials & self.trialResponse
+        
+        self.engagedTrials = np.ones(self.nTrials,dtype=bool)
+        for i in range(self.nTrials):
+            r = self.trialResponse[:i+1][self.goTrials[:i+1]]
+            if r.size > self.engagedThresh:
+                if r[-self.engagedThresh:].sum() < 1:
+                    self.engagedTrials[i] = False
+        
+        self.catchResponseRate = []
+        self.hitRate = []
+        self.hitCount = []
+        self.falseAlarmRate = []
+        self.falseAlarmSameModal = []
+        self.falseAlarmOtherModalGo = []
+        self.falseAlarmOtherModalNogo = []
+        self.dprimeSameModal = []
+        self.dprimeOtherModalGo = []
+        self.dprimeNonrewardedModal = []
+        for blockInd,rew in enumerate(self.blockStimRewarded):
+            blockTrials = (self.trialBlock == blockInd + 1) & self.engagedTrials & (~self.trialRepeat)
+            self.catchResponseRate.append(self.catchResponseTrials[blockTrials].sum() / self.catchTrials[blockTrials].sum())
+            self.hitRate.append(self.hitTrials[blockTrials].sum() / self.goTrials[blockTrials].sum())
+            self.hitCount.append(self.hitTrials[blockTrials].sum())
+            self.falseAlarmRate.append(self.falseAlarmTrials[blockTrials].sum() / self.nogoTrials[blockTrials].sum())
+            sameModal = blockTrials & self.sameModalNogoTrials
+            otherModalGo = blockTrials & self.otherModalGoTrials
+            otherModalNogo = blockTrials & self.otherModalNogoTrials
+            self.falseAlarmSameModal.append(self.falseAlarmTrials[sameModal].sum() / sameModal.sum())
+            self.falseAlarmOtherModalGo.append(self.falseAlarmTrials[otherModalGo].sum() / otherModalGo.sum())
+            self.falseAlarmOtherModalNogo.append(self.falseAlarmTrials[otherModalNogo].sum() / otherModalNogo.sum())
+            self.dprimeSameModal.append(calcDprime(self.hitRate[-1],self.falseAlarmSameModal[-1],self.goTrials[blockTrials].sum(),sameModal.sum()))
+            self.dprimeOtherModalGo.append(calcDprime(self.hitRate[-1],self.falseAlarmOtherModalGo[-1],self.goTrials[blockTrials].sum(),otherModalGo.sum()))
+            self.dprimeNonrewardedModal.append(calcDprime(self.falseAlarmOtherModalGo[-1],self.falseAlarmOtherModalNogo[-1],otherModalGo.sum(),otherModalNogo.sum()))
+
+    
+    def calcRunningSpeedBins(self, binSize):
+        """Bin end times and mean running speed for bins of binSize frames, from the in-memory runningSpeed.
+
+        Not available after a chunked load, where only runningSpeedBinSize bins are computed.
+        """
+        if self.runningSpeed is None:
+            raise ValueError('runningSpeed is not loaded, reload without chunkSize to bin it by %d frames' % binSize)
+        nSpeed = min(self.runningSpeed.size,self.frameTimes.size)
+        binEndFrames = np.minimum(np.arange(0,nSpeed,binSize)+binSize,nSpeed)-1
+        return self.frameTimes[binEndFrames], calcBinMeans(self.runningSpeed[:nSpeed],binSize)
+
+
+def calcResponseTimeDistributions(obj, groupByBlock=False, groupByEngaged=False, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+    """Empirical CDFs and quantiles of response times for each stimulus.
+
+    Response trials of a loaded DynRoutData are grouped by stimulus, and
+    optionally by block and engaged state, and sorted once with a lexsort so
+    every group's response times are contiguous and ordered. cumProb matches
+    np.sum(rt <= t)/rt.size for each sorted t, and quantiles use the same
+    linear interpolation as np.quantile.
+
+    Returns a list of dicts, one per group that has responses, ordered by
+    stimulus label then block then engaged state, with keys stim, block and
+    engaged (only when grouped by them), n, responseTimes, cumProb, mean,
+    median and quantiles (a dict of quantile -> response time).
+    """
+    trials = np.where(obj.trialResponse & ~np.isnan(obj.responseTimes))[0]
+    rt = obj.responseTimes[trials]
+    stimOrder = np.argsort(obj.stimLabels, kind='stable')
+    stimRank = np.empty(stimOrder.size, dtype=int)
+    stimRank[stimOrder] = np.arange(stimOrder.size)
+    keys = [stimRank[obj.trialStimCode[trials]]]
+    if groupByBlock:
+        keys.append(obj.trialBlock[trials])
+    if groupByEngaged:
+        keys.append(obj.engagedTrials[trials].astype(int))
+    if rt.size == 0:
+        return []
+
+    # np.lexsort sorts by its last key first
+    order = np.lexsort((rt, *keys[::-1]))
+    rt = rt[order]
+    keys = np.stack([k[order] for k in keys])
+
+    newGroup = np.ones(rt.size, dtype=bool)
+    newGroup[1:] = np.any(keys[:, 1:] != keys[:, :-1], axis=0)
+    groupStarts = np.where(newGroup)[0]
+    groupSizes = np.diff(np.append(groupStarts, rt.size))
+    groupIndex = np.cumsum(newGroup) - 1
+
+    # ties share the cumulative probability of the last of their run
+    newRun = newGroup.copy()
+    newRun[1:] |= rt[1:] != rt[:-1]
+    runEnds = np.append(np.where(newRun)[0][1:], rt.size)
+    runIndex = np.cumsum(newRun) - 1
+    cumProb = (runEnds[runIndex] - groupStarts[groupIndex]) / groupSizes[groupIndex]
+
+    q = np.asarray(sorted(set(quantiles) | {0.5}), dtype=float)
+    h = (groupSizes[:, None] - 1) * q[None, :]
+    lo = np.floor(h).astype(int)
+    hi = np.minimum(lo + 1, groupSizes[:, None] - 1)
+    rtLo = rt[groupStarts[:, None] + lo]
+    rtHi = rt[groupStarts[:, None] + hi]
+    quantileValues = rtLo + (h - lo) * (rtHi - rtLo)
+    means = np.add.reduceat(rt, groupStarts) / groupSizes
+
+    distributions = []
+    for i, (start, size) in enumerate(zip(groupStarts, groupSizes)):
+        dist = {'stim': obj.stimLabels[stimOrder[keys[0, start]]]}
+        if groupByBlock:
+            dist['block'] = int(keys[1, start])
+        if groupByEngaged:
+            dist['engaged'] = bool(keys[-1, start])
+        dist['n'] = int(size)
+        dist['responseTimes'] = rt[start:start+size]
+        dist['cumProb'] = cumProb[start:start+size]
+        dist['mean'] = means[i]
+        dist['median'] = quantileValues[i, np.searchsorted(q, 0.5)]
+        dist['quantiles'] = {float(p): value for p, value in zip(q, quantileValues[i]) if p in quantiles}
+        distributions.append(dist)
+    return distributions
+
+
+def calcRollingPerformance(obj, windowSize=10, engagedOnly=True, excludeRepeats=True):
+    """Hit rate, false alarm rates and d-prime over a sliding window of trials ending at each trial.
+
+    Windows hold the last windowSize trials of the current block (they start
+    at the block start, via blockTrial, until windowSize trials have passed),
+    so they never mix blocks. Like the block metrics of DynRoutData, only
+    engaged and non-repeat trials are counted by default, so a window as
+    long as a block reproduces the block's metrics at its last trial. Counts
+    come from cumulative sums, so a session takes O(n) regardless of
+    windowSize.
+
+    Returns a dict of per-trial arrays with the same names as the block
+    metrics: hitRate, falseAlarmRate, falseAlarmSameModal,
+    falseAlarmOtherModalGo, falseAlarmOtherModalNogo, dprimeSameModal,
+    dprimeOtherModalGo and dprimeNonrewardedModal. Rates are nan where the
+    window has no trials of that type.
+    """
+    counted = np.ones(obj.nTrials, dtype=bool)
+    if engagedOnly:
+        counted &= obj.engagedTrials
+    if excludeRepeats:
+        counted &= ~obj.trialRepeat
+
+    trials = np.arange(obj.nTrials)
+    windowStart = np.maximum(trials - obj.blockTrial, trials - windowSize + 1)
+
+    def windowCounts(trialType):
+        cs = np.concatenate(([0], np.cumsum(trialType & counted)))
+        return cs[trials + 1] - cs[windowStart]
+
+    go = windowCounts(obj.goTrials)
+    nogo = windowCounts(obj.nogoTrials)
+    sameModal = windowCounts(obj.sameModalNogoTrials)
+    otherModalGo = windowCounts(obj.otherModalGoTrials)
+    otherModalNogo = windowCounts(obj.otherModalNogoTrials)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        performance = {
+            'hitRate': windowCounts(obj.hitTrials) / go,
+            'falseAlarmRate': windowCounts(obj.falseAlarmTrials) / nogo,
+            'falseAlarmSameModal': windowCounts(obj.falseAlarmTrials & obj.sameModalNogoTrials) / sameModal,
+            'falseAlarmOtherModalGo': windowCounts(obj.falseAlarmTrials & obj.otherModalGoTrials) / otherModalGo,
+            'falseAlarmOtherModalNogo': windowCounts(obj.falseAlarmTrials & obj.otherModalNogoTrials) / otherModalNogo,
+        }
+    performance['dprimeSameModal'] = calcDprime(performance['hitRate'], performance['falseAlarmSameModal'], go, sameModal)
+    performance['dprimeOtherModalGo'] = calcDprime(performance['hitRate'], performance['falseAlarmOtherModalGo'], go, otherModalGo)
+    performance['dprimeNonrewardedModal'] = calcDprime(performance['falseAlarmOtherModalGo'], performance['falseAlarmOtherModalNogo'], otherModalGo, otherModalNogo)
+    return performance
+
+
+def calcTrialQuiescentViolations(obj):
+    """Number of quiescent period violations between the start and end frame of each trial."""
+    violationFrames = np.sort(obj.quiescentViolationFrames)
+    return (np.searchsorted(violationFrames, obj.trialEndFrame, side='left') -
+            np.searchsorted(violationFrames, obj.trialStartFrame, side='right'))
+
+
+def sortedWindow(values, start, stop, pad=1e-6):
+    """The part of a sorted array within [start-pad, stop+pad], found by bisection.
+
+    The padding leaves room for callers that re-apply their own (e.g. relative
+    time) comparisons, which can round differently at the window edges.
+    """
+    return values[np.searchsorted(values, start-pad, side='left'):np.searchsorted(values, stop+pad, side='right')]
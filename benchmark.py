@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import tempfile
+import functools
+import tracemalloc
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # benchmarks never open windows
+import matplotlib.pyplot as plt
+
+import behavior_metrics
+import generate_plots
+from synthetic_session import generate_synthetic_session
+
+
+bundled_filepath = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "DynamicRouting1_674721_20230710_084322.hdf5",
+)
+
+plot_function_names = tuple(func.__name__ for func in generate_plots.plot_functions)
+
+
+import_time_modules = ("behavior_metrics", "generate_plots")
+
+# call time differences below this many seconds are timer noise, never a regression
+min_regression_s = 0.01
+
+
+# frames per slice of the chunked loadBehavData benchmark
+load_chunk_size = 10000
+
+
+def load_behavior_data(behavior_filepath: str, chunkSize=None, floatDtype=np.float64):
+    obj = behavior_metrics.DynRoutData()
+    obj.loadBehavData(behavior_filepath, chunkSize=chunkSize, floatDtype=floatDtype)
+    return obj
+
+
+def draw_open_figures():
+    for num in plt.get_fignums():
+        plt.figure(num).canvas.draw()
+    plt.close("all")
+
+
+def time_call(func, *args, repeat: int = 1) -> float:
+    """Returns the fastest of `repeat` wall-clock timings of `func(*args)`, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+        plt.close("all")
+    return min(timings)
+
+
+def peak_memory(func, *args) -> int:
+    """Returns the peak bytes allocated while running `func(*args)`, as traced by tracemalloc."""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        plt.close("all")
+
+
+def measure_import_time(module: str) -> dict:
+    """Times importing `module` in a fresh interpreter and reports which heavy packages it pulled in."""
+    code = (
+        "import sys, time, json; start = time.perf_counter(); import %s; "
+        "print(json.dumps([time.perf_counter() - start, "
+        "[name for name in ('matplotlib', 'scipy', 'pandas') if name in sys.modules]]))"
+    ) % module
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    import_s, heavy_modules = json.loads(output.strip().splitlines()[-1])
+    return {"module": module, "import_s": import_s, "heavy_modules": heavy_modules}
+
+
+def benchmark_session(behavior_filepath: str, function_names=plot_function_names, repeat: int = 1,
+                      measure_memory: bool = True) -> list:
+    """Times loading and each plot function for one behavior file.
+
+    Loading is timed in memory, chunked and with float32 per-frame arrays.
+    Plot function timings include their own loadBehavData call, `draw_s` is the
+    time to render every figure they opened.
+    """
+    results = []
+    benchmarks = [
+        ("loadBehavData", load_behavior_data),
+        ("loadBehavData(chunkSize=%d)" % load_chunk_size,
+         functools.partial(load_behavior_data, chunkSize=load_chunk_size)),
+        ("loadBehavData(floatDtype=float32)", functools.partial(load_behavior_data, floatDtype=np.float32)),
+    ]
+    benchmarks.extend((name, getattr(generate_plots, name)) for name in function_names)
+    for name, func in benchmarks:
+        result = {"name": name, "call_s": time_call(func, behavior_filepath, repeat=repeat)}
+        if not name.startswith("loadBehavData"):
+            func(behavior_filepath)
+            start = time.perf_counter()
+            draw_open_figures()
+            result["draw_s"] = time.perf_counter() - start
+        if measure_memory:
+            result["peak_mb"] = peak_memory(func, behavior_filepath) / 1e6
+        results.append(result)
+    return results
+
+
+def run_benchmarks(scales=(1, 10), function_names=plot_function_names, repeat: int = 1,
+                   measure_memory: bool = True, work_dir: str = None) -> list:
+    """Benchmarks the bundled session and synthetic sessions at each of `scales`.
+
+    Scale 1 uses the bundled file directly, other scales repeat its trials and
+    frames with generate_synthetic_session.
+    """
+    sessions = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for scale in scales:
+            if scale == 1:
+                filepath = bundled_filepath
+            else:
+                filepath = generate_synthetic_session(
+                    bundled_filepath,
+                    os.path.join(tmp_dir, "x%d" % scale, os.path.basename(bundled_filepath)),
+                    scale,
+                )
+            obj = load_behavior_data(filepath)
+            sessions.append({
+                "scale": scale,
+                "n_trials": int(obj.nTrials),
+                "n_frames": int(obj.frameIntervals.size),
+                "results": benchmark_session(filepath, function_names, repeat, measure_memory),
+            })
+            del obj
+    return sessions
+
+
+def compare_results(sessions: list, previous_sessions: list, tolerance: float = 0.2) -> list:
+    """Call times and peak memory more than `tolerance` (a fraction) above a previous run, per scale.
+
+    Only benchmarks present at the same scale in both runs are compared.
+    Returns a description of each regression, empty if there are none.
+    """
+    previous = {
+        (session["scale"], result["name"]): result
+        for session in previous_sessions for result in session["results"]
+    }
+    regressions = []
+    for session in sessions:
+        for result in session["results"]:
+            before = previous.get((session["scale"], result["name"]))
+            if before is None:
+                continue
+            if (result["call_s"] > before["call_s"] * (1 + tolerance)
+                    and result["call_s"] - before["call_s"] > min_regression_s):
+                regressions.append("scale %dx %s: call %.3f s, was %.3f s" % (
+                    session["scale"], result["name"], result["call_s"], before["call_s"]))
+            if "peak_mb" in result and "peak_mb" in before and result["peak_mb"] > before["peak_mb"] * (1 + tolerance):
+                regressions.append("scale %dx %s: peak %.1f MB, was %.1f MB" % (
+                    session["scale"], result["name"], result["peak_mb"], before["peak_mb"]))
+    return regressions
+
+
+def format_import_times(import_times: list) -> str:
+    lines = ["  %-36s %10s  %s" % ("import", "time (s)", "heavy modules")]
+    for result in import_times:
+        lines.append("  %-36s %10.3f  %s" % (
+            result["module"], result["import_s"], ", ".join(result["heavy_modules"]) or "-"))
+    return "\n".join(lines)
+
+
+def format_results(sessions: list) -> str:
+    lines = []
+    for session in sessions:
+        lines.append("scale %dx: %d trials, %d frames" % (
+            session["scale"], session["n_trials"], session["n_frames"]))
+        lines.append("  %-36s %10s %10s %10s" % ("benchmark", "call (s)", "draw (s)", "peak (MB)"))
+        for result in session["results"]:
+            lines.append("  %-36s %10.3f %10s %10s" % (
+                result["name"],
+                result["call_s"],
+                "%.3f" % result["draw_s"] if "draw_s" in result else "-",
+                "%.1f" % result["peak_mb"] if "peak_mb" in result else "-",
+            ))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10],
+                        help="session sizes as multiples of the bundled session, e.g. 1 10 100")
+    parser.add_argument("--functions", type=str, nargs="+", default=list(plot_function_names),
+                        choices=plot_function_names)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc pass used to measure peak memory")
+    parser.add_argument("--output", type=str, default=None,
+                        help="write results as json to this path")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="json written by a previous --output, exit non-zero on a regression from it")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction a call time or peak memory may grow by before --compare fails")
+
+    args = parser.parse_args()
+
+    import_times = [measure_import_time(module) for module in import_time_modules]
+    print(format_import_times(import_times))
+    sessions = run_benchmarks(args.scales, args.functions, args.repeat, not args.no_memory)
+    print(format_results(sessions))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"imports": import_times, "sessions": sessions}, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare_results(sessions, json.load(f)["sessions"], args.tolerance)
+        for regression in regressions:
+            print("regression:", regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,66 @@
+import os
+import csv
+import sys
+from typing import Dict, Iterable, List
+
+from behavior_metrics import DynRoutData, calcResponseTimeDistributions
+
+
+def summarize_response_times(behavior_filepath: str, group_by_block: bool = False,
+                             group_by_engaged: bool = False,
+                             quantiles: Iterable[float] = (0.1, 0.25, 0.5, 0.75, 0.9)) -> List[Dict]:
+    """Response time summary rows for one session, one row per stimulus group.
+
+    Each row has the session file name, subject, stimulus, block and/or
+    engaged state when grouped by them, trial count, mean, median and one
+    column per quantile named like `q0.25`.
+    """
+    obj = DynRoutData()
+    obj.loadBehavData(behavior_filepath)
+    quantiles = tuple(quantiles)
+    rows = []
+    for dist in calcResponseTimeDistributions(obj, group_by_block, group_by_engaged, quantiles):
+        row = {
+            "session": os.path.basename(behavior_filepath),
+            "subject": obj.subjectName,
+            "stim": dist["stim"],
+        }
+        if group_by_block:
+            row["block"] = dist["block"]
+        if group_by_engaged:
+            row["engaged"] = dist["engaged"]
+        row["n"] = dist["n"]
+        row["mean"] = dist["mean"]
+        row["median"] = dist["median"]
+        row.update({f"q{q}": dist["quantiles"][q] for q in quantiles})
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("behavior_filepaths", type=str, nargs="+")
+    parser.add_argument("--by-block", action="store_true")
+    parser.add_argument("--by-engaged", action="store_true")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.1, 0.25, 0.5, 0.75, 0.9])
+    parser.add_argument("--output", type=str, default=None,
+                        help="csv path, defaults to stdout")
+
+    args = parser.parse_args()
+
+    rows = []
+    for behavior_filepath in args.behavior_filepaths:
+        rows.extend(summarize_response_times(
+            behavior_filepath, args.by_block, args.by_engaged, args.quantiles))
+
+    output = open(args.output, "w", newline="") if args.output is not None else sys.stdout
+    try:
+        if rows:
+            writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if output is not sys.stdout:
+            output.close()
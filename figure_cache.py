@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+import inspect
+import tempfile
+import functools
+from typing import Callable, Dict, List, Optional, Tuple
+
+import matplotlib.pyplot as plt
+
+import behavior_metrics
+import generate_plots
+
+
+# bump to invalidate every cached figure, e.g. after a matplotlib style change
+figure_cache_version = "2"
+
+hash_chunk_size = 1 << 20
+
+# generate_* parameters that only change how the session is loaded, not the figure
+loading_params = ("chunk_size", )
+
+
+def hash_file(filepath: str) -> str:
+    """sha256 of a file's contents, read in fixed size chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(hash_chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def hash_source(func: Callable) -> str:
+    """sha256 of the source files of `func`'s module and of behavior_metrics.
+
+    Any edit to the plot module or to DynRoutData changes the code version of
+    every plot function defined in it.
+    """
+    digest = hashlib.sha256()
+    for module_path in (inspect.getsourcefile(func), inspect.getsourcefile(behavior_metrics)):
+        digest.update(hash_file(module_path).encode("utf8"))
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """On-disk cache of rendered generate_* figures.
+
+    Entries are keyed by a hash of the behavior file's contents (sessions can
+    be given as a path or a loaded DynRoutData, whose chunked loading is part
+    of the key), the plot function's name, its bound parameters (defaults
+    included, loading options excluded) and a code version made from the plot
+    module's source and `figure_cache_version`, so an entry is only reused
+    while all of those are unchanged.
+    """
+
+    def __init__(self, cache_dir: str, image_format: str = "png", dpi: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.image_format = image_format
+        self.dpi = dpi
+        self.hits = 0
+        self.misses = 0
+        # (path, size, mtime) -> content hash, so unchanged files are hashed once per process
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def session_hash(self, behavior_filepath) -> str:
+        """Content hash of a behavior file, given its path or a DynRoutData loaded from it."""
+        if isinstance(behavior_filepath, behavior_metrics.DynRoutData):
+            behavior_filepath = behavior_filepath.behavDataPath
+        stat = os.stat(behavior_filepath)
+        file_key = (os.path.abspath(behavior_filepath), stat.st_size, stat.st_mtime_ns)
+        if file_key not in self._file_hashes:
+            self._file_hashes[file_key] = hash_file(behavior_filepath)
+        return self._file_hashes[file_key]
+
+    def key(self, func: Callable, behavior_filepath, **params) -> str:
+        bound = inspect.signature(func).bind(behavior_filepath, **params)
+        bound.apply_defaults()
+        if bound.arguments.get("return_data"):
+            raise ValueError("Only figures are cached, call %s without return_data." % func.__name__)
+        bound_params = {name: value for name, value in bound.arguments.items()
+                        if name != "behavior_filepath" and name not in loading_params}
+        key_data = {
+            "session": self.session_hash(behavior_filepath),
+            "chunk_loaded": getattr(behavior_filepath, "chunkSize", None) is not None,
+            "function": func.__name__,
+            "params": bound_params,
+            "code_version": [figure_cache_version, hash_source(func)],
+            "format": [self.image_format, self.dpi],
+        }
+        return hashlib.sha256(
+            json.dumps(key_data, sort_keys=True, default=repr).encode("utf8")
+        ).hexdigest()
+
+    def entry_paths(self, key: str, n_images: int = 0) -> Tuple[str, List[str]]:
+        """Paths of an entry's manifest and of its first `n_images` images."""
+        entry = os.path.join(self.cache_dir, key[:2], key)
+        return f"{entry}.json", [f"{entry}_{i}.{self.image_format}" for i in range(n_images)]
+
+    def get(self, key: str) -> Tuple[bool, List[str]]:
+        """Returns (hit, image paths), the paths are empty for a cached call that drew no figure."""
+        manifest_path, _ = self.entry_paths(key)
+        try:
+            with open(manifest_path) as f:
+                n_images = json.load(f)["n_images"]
+        except (OSError, ValueError, KeyError):
+            return False, []
+        return True, self.entry_paths(key, n_images)[1]
+
+    def render(self, func: Callable, behavior_filepath, **params) -> List[str]:
+        """Returns the paths of every figure drawn by `func(behavior_filepath, **params)`, in the order they were opened.
+
+        The figures are only generated if no entry exists for the current key.
+        Functions can draw several figures, e.g. generate_run_speed_mean_block
+        draws one per block, or none, e.g. generate_running_speed for a session
+        without a rotary encoder.
+        """
+        key = self.key(func, behavior_filepath, **params)
+        hit, image_paths = self.get(key)
+        if hit:
+            self.hits += 1
+            return image_paths
+        self.misses += 1
+
+        open_figures = set(plt.get_fignums())
+        try:
+            fig = func(behavior_filepath, **params)
+            figs = [plt.figure(num) for num in plt.get_fignums() if num not in open_figures]
+            if fig is not None and fig not in figs:
+                figs.append(fig)
+            manifest_path, image_paths = self.entry_paths(key, len(figs))
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            # images first and the manifest last, each written then renamed, so readers never see a partial entry
+            for fig, image_path in zip(figs, image_paths):
+                self._write(image_path, lambda path: fig.savefig(path, format=self.image_format, dpi=self.dpi))
+
+            def write_manifest(path):
+                with open(path, "w") as f:
+                    json.dump({"n_images": len(figs)}, f)
+
+            self._write(manifest_path, write_manifest)
+            return image_paths
+        finally:
+            for num in plt.get_fignums():
+                if num not in open_figures:
+                    plt.close(num)
+
+    @staticmethod
+    def _write(path: str, write: Callable[[str], None]):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=os.path.splitext(path)[1])
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import matplotlib
+    matplotlib.use("Agg")  # figures are only written to disk
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cache_dir", type=str)
+    parser.add_argument("behavior_filepaths", type=str, nargs="+")
+    parser.add_argument("--format", type=str, default="png")
+
+    args = parser.parse_args()
+
+    cache = FigureCache(args.cache_dir, image_format=args.format)
+    for behavior_filepath in args.behavior_filepaths:
+        for func in generate_plots.plot_functions:
+            print(behavior_filepath, func.__name__, *cache.render(func, behavior_filepath))
+    print(cache.stats())
@@ -3,14 +3,39 @@ import json
 import requests
 import datetime
 import itertools
-from typing import Dict, Iterable, Tuple, Any
+from typing import Dict, Iterable, Optional, Tuple, Any
 from bs4 import BeautifulSoup
 
+from http_cache import HTTPCache
+
+
+# stage and state records don't change once created, so cached copies are reused without revalidating
+mtrain_long_lived_paths = ("/api/v1/stages", "/api/v1/states")
+
+# on-disk cache used by every mtrain request, see use_http_cache
+http_cache: HTTPCache = None
+
+
+def use_http_cache(cache: Optional[HTTPCache]):
+    """Routes mtrain requests through `cache`, or straight to mtrain if None."""
+    global http_cache
+    http_cache = cache
+
+
+def make_mtrain_http_cache(cache_dir: str) -> HTTPCache:
+    return HTTPCache(cache_dir, long_lived_paths=mtrain_long_lived_paths)
+
+
+def mtrain_get(uri: str, params: Dict = None) -> requests.Response:
+    if http_cache is None:
+        return requests.get(uri, params=params)
+    return http_cache.get(uri, params)
+
 
 def query_mtrain_by_id(uri: str, _id: str) -> Dict:
     """Attempts to query mtrain for an object with a specific id.
     """
-    response = requests.get(
+    response = mtrain_get(
         uri,
         params={
             # api requires queries to serialized json...:/
@@ -119,7 +144,7 @@ def get_mtrain_training_history(api_base: str, subject_id: str, session_id: str)
     None, this metric was not found on mtrain
     """
     resolved_uri = f"{api_base}/df/session_metrics"
-    response = requests.get(resolved_uri)
+    response = mtrain_get(resolved_uri)
     if response.status_code not in [200]:
         response.raise_for_status()
 
@@ -242,7 +267,17 @@ def generate_metrics_view(entry: TrainingHistoryEntry, hide_header = False) -> s
 
 def generate_mtrain_table(api_base: str, subject_id: str, session_id: str) -> str:
     training_history = get_mtrain_training_history(api_base, subject_id, session_id)
-    training_history.reverse()  # corbett wants datetime descending?
+    return generate_training_history_table(training_history)
+
+
+def generate_training_history_table(training_history: Iterable[TrainingHistoryEntry]) -> str:
+    """Renders a training history from `get_mtrain_training_history` as an html table.
+
+    Notes
+    -----
+    - doesn't modify `training_history`, so cached histories can be rendered repeatedly
+    """
+    training_history = list(training_history)[::-1]  # corbett wants datetime descending?
 
     table_header = f"<tr><th>Session datetime</th><th>Stage name</th><th>Session Metrics</th></tr>"
     rows = [
@@ -261,9 +296,15 @@ if __name__ == "__main__":
     parser.add_argument("api_base", type=str)
     parser.add_argument("subject_id", type=str)
     parser.add_argument("session_id", type=str)
+    parser.add_argument("--cache-dir", type=str, default=".mtrain_cache",
+                        help="on-disk cache of mtrain responses")
+    parser.add_argument("--no-cache", action="store_true")
 
     args = parser.parse_args()
 
+    if not args.no_cache:
+        use_http_cache(make_mtrain_http_cache(args.cache_dir))
+
     training_history = get_mtrain_training_history(
         args.api_base, args.subject_id, args.session_id)
 
@@ -291,14 +332,13 @@ if __name__ == "__main__":
     table_path = pathlib.Path("table_example_2.html")
     table_path.write_text(
         html_body.format(
-            generate_mtrain_table(
-                args.api_base,
-                args.subject_id,
-                args.session_id,
-            )
+            generate_training_history_table(training_history)
         )
     )
 
+    if http_cache is not None:
+        print("mtrain cache:", http_cache.stats())
+
     # def compute_checksum(path: pathlib.Path):
     #     assert path.exists(), "Path doesnt exist: %s" % path.as_posix()
     #     contents = path.read_text().strip("\n").strip("\t")
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+
+# response headers kept with a cached body
+stored_headers = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Date")
+
+
+class HTTPCache:
+    """On-disk cache of http GET responses, revalidated with ETag / If-Modified-Since.
+
+    A stored response is reused without contacting the server while it's
+    fresh: for `long_lived_ttl` seconds if its url path ends with one of
+    `long_lived_paths`, otherwise for the response's Cache-Control max-age,
+    if any. Stale responses are revalidated with a conditional request, so an
+    unchanged resource costs a 304 instead of its full body. Responses marked
+    no-store or without a 200 status aren't stored.
+
+    Thread safe, entries are written to a temporary file then renamed.
+    """
+
+    def __init__(self, cache_dir: str, long_lived_paths: Iterable[str] = (),
+                 long_lived_ttl: float = 7 * 24 * 3600, timeout: Optional[float] = None):
+        self.cache_dir = cache_dir
+        self.long_lived_paths = tuple(path.rstrip("/") for path in long_lived_paths)
+        self.long_lived_ttl = long_lived_ttl
+        self.timeout = timeout
+        self.hits = 0  # served from disk without a request
+        self.revalidated = 0  # server answered 304 Not Modified
+        self.misses = 0  # full response transferred
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_paths(self, url: str) -> Tuple[str, str]:
+        """Paths of a url's metadata and body."""
+        key = hashlib.sha256(url.encode("utf8")).hexdigest()
+        entry = os.path.join(self.cache_dir, key[:2], key)
+        return f"{entry}.json", f"{entry}.body"
+
+    def load(self, url: str) -> Tuple[Optional[Dict], Optional[bytes]]:
+        meta_path, body_path = self.entry_paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def max_age(self, url: str, headers: Dict[str, str]) -> float:
+        """Seconds a response stays fresh after it's stored or revalidated."""
+        if urlparse(url).path.rstrip("/").endswith(self.long_lived_paths):
+            return self.long_lived_ttl
+        match = re.search(r"max-age=(\d+)", headers.get("Cache-Control", ""))
+        return float(match.group(1)) if match else 0.0
+
+    def store(self, url: str, meta: Dict, body: Optional[bytes] = None):
+        """Writes an entry's metadata, and its body unless it's unchanged (None)."""
+        meta_path, body_path = self.entry_paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        outputs = [(meta_path, json.dumps(meta).encode("utf8"))]
+        if body is not None:
+            outputs.insert(0, (body_path, body))  # body first, so metadata never points at a missing body
+        for path, content in outputs:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+    def get(self, url: str, params: Optional[Dict] = None) -> requests.Response:
+        """GET `url`, from the cache if possible. Returns a requests.Response either way."""
+        url = requests.Request("GET", url, params=params).prepare().url
+        meta, body = self.load(url)
+        if meta is not None and time.time() - meta["stored_at"] < meta["max_age"]:
+            self._count("hits")
+            return self.cached_response(url, meta, body)
+
+        conditional_headers = {}
+        if meta is not None:
+            if "ETag" in meta["headers"]:
+                conditional_headers["If-None-Match"] = meta["headers"]["ETag"]
+            if "Last-Modified" in meta["headers"]:
+                conditional_headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        response = requests.get(url, headers=conditional_headers, timeout=self.timeout)
+
+        if response.status_code == 304 and meta is not None:
+            self._count("revalidated", len(response.content))
+            meta["headers"].update(
+                (name, response.headers[name]) for name in stored_headers if name in response.headers)
+            meta["stored_at"] = time.time()
+            meta["max_age"] = self.max_age(url, meta["headers"])
+            self.store(url, meta)
+            return self.cached_response(url, meta, body)
+
+        self._count("misses", len(response.content))
+        if response.status_code == 200 and "no-store" not in response.headers.get("Cache-Control", ""):
+            headers = {name: response.headers[name] for name in stored_headers if name in response.headers}
+            self.store(url, {
+                "url": url,
+                "headers": headers,
+                "encoding": response.encoding,
+                "stored_at": time.time(),
+                "max_age": self.max_age(url, headers),
+            }, response.content)
+        return response
+
+    @staticmethod
+    def cached_response(url: str, meta: Dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers.update(meta["headers"])
+        response.encoding = meta["encoding"]
+        response._content = body
+        return response
+
+    def _count(self, outcome: str, n_bytes: int = 0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.bytes_received += n_bytes
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.revalidated + self.misses
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.revalidated) / total if total else 0.0,
+                "bytes_received": self.bytes_received,
+            }
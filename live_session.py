@@ -0,0 +1,416 @@
+import os
+import re
+import time
+import collections
+import h5py
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+
+from behavior_metrics import DynRoutData, calcDprime
+
+
+# datasets that grow while a session is being written
+perFrameDatasets = ('frameIntervals', )
+perTrialDatasets = (
+    'trialEndFrame',
+    'trialStartFrame',
+    'trialStimStartFrame',
+    'trialStim',
+    'trialBlock',
+    'trialRepeat',
+    'trialResponse',
+    'trialResponseFrame',
+    'trialRewarded',
+    'trialAutoRewardScheduled',
+    'trialAutoRewarded',
+)
+eventDatasets = ('lickFrames', 'rewardFrames', 'rewardSize')
+
+# per-block trial counts accumulated for block metrics, see LiveDynRoutData.updateBlockMetrics
+blockCountNames = (
+    'catch', 'catchResponse', 'go', 'hit', 'nogo', 'falseAlarm',
+    'sameModal', 'sameModalFalseAlarm', 'otherModalGo', 'otherModalGoFalseAlarm',
+    'otherModalNogo', 'otherModalNogoFalseAlarm',
+)
+
+
+class LiveDynRoutData(DynRoutData):
+    """DynRoutData for a behavior file that is still being written.
+
+    The file is opened for SWMR reading and each call to `update` reads only
+    what was appended since the previous call. Engagement, block metrics,
+    cumulative rewards and lick raster rows are extended from the new trials
+    instead of being recomputed from trial 0.
+
+    HDF5 SWMR does not support variable-length types, so the task must write
+    the growing datasets (including trialStim) with fixed-length dtypes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.preTime = 4
+        self.postTime = 4
+        self.minLickInterval = 0.05
+        # seconds lickFrames may be written behind frameIntervals, see updateLicks
+        self.lickWriteDelay = 10
+
+    def openBehavData(self, filePath):
+        self.behavDataPath = filePath
+        self.h5 = h5py.File(self.behavDataPath, 'r', libver='latest', swmr=True)
+        d = self.h5
+
+        self.subjectName = re.search('.*_([0-9]{6})_',os.path.basename(self.behavDataPath)).group(1)
+        self.rigName = d['rigName'].asstr()[()]
+        self.taskVersion = d['taskVersion'].asstr()[()] if 'taskVersion' in d else None
+        self.startTime = d['startTime'].asstr()[()]
+
+        if 'trialAutoRewardScheduled' not in d:
+            raise ValueError('Live mode requires trialAutoRewardScheduled, file layout is too old: %s' % filePath)
+
+        self.autoRewardOnsetFrame = d['autoRewardOnsetFrame'][()]
+        self.quiescentFrames = d['quiescentFrames'][()]
+        self.responseWindow = d['responseWindow'][:]
+        self.responseWindowTime = np.array(self.responseWindow)/self.frameRate
+
+        # the block schedule is a task parameter, so it is complete before the first trial
+        self.blockStimRewarded = d['blockStimRewarded'].asstr()[:]
+        self.nBlocks = self.blockStimRewarded.size
+
+        self.stimLabels = np.array([], dtype=object)
+        self.stimCodes = {}
+        self.stimModalityCodes = {}
+        self.stimModalityCode = np.array([], dtype=int)
+        self.stimIsCatch = np.array([], dtype=bool)
+        self.stimIsMultimodal = np.array([], dtype=bool)
+        self.stimIsOtherModalGo = np.array([], dtype=bool)
+        self.blockStimRewardedCode = np.array([self.getStimCode(stim) for stim in self.blockStimRewarded])
+
+        self.frameTimes = np.array([0.])
+        self.nTrials = 0
+        self.trialStim = np.array([], dtype=object)
+        self.trialStimCode = np.array([], dtype=int)
+        self.trialBlock = np.array([], dtype=int)
+        self.trialStartTimes = np.array([])
+        self.stimStartTimes = np.array([])
+        self.trialRepeat = np.array([], dtype=bool)
+        self.trialResponse = np.array([], dtype=bool)
+        self.trialRewarded = np.array([], dtype=bool)
+        self.autoRewarded = np.array([], dtype=bool)
+        self.responseTimes = np.array([])
+        self.engagedTrials = np.array([], dtype=bool)
+        for name in ('catchTrials', 'goTrials', 'nogoTrials', 'sameModalNogoTrials',
+                     'otherModalGoTrials', 'otherModalNogoTrials', 'hitTrials', 'falseAlarmTrials'):
+            setattr(self, name, np.array([], dtype=bool))
+
+        self.recentGoResponses = collections.deque(maxlen=self.engagedThresh)
+        self.goTrialCount = 0
+        self.engaged = True
+        self.blockCounts = {name: np.zeros(self.nBlocks, dtype=int) for name in blockCountNames}
+
+        self.lickTimes = np.array([])
+        self.lastLickTimeDetected = -np.inf
+        self.nLickFrames = 0
+        self.lickRaster = []
+
+        self.rewardTimes = np.array([])
+        self.cumulativeRewardSize = np.array([])
+        self.cumulativeRewardCount = np.array([], dtype=int)
+        self.cumulativeVolume = np.array([])
+
+        self.updateBlockMetrics()
+
+    def getStimCode(self, stim):
+        """Returns the code of `stim` in stimLabels, adding it and its lookups if it is new."""
+        if stim not in self.stimCodes:
+            self.stimCodes[stim] = len(self.stimCodes)
+            self.stimLabels = np.append(self.stimLabels, stim)
+            modality = self.stimModalityCodes.setdefault(stim[:-1], len(self.stimModalityCodes))
+            self.stimModalityCode = np.append(self.stimModalityCode, modality)
+            self.stimIsCatch = np.append(self.stimIsCatch, stim == 'catch')
+            self.stimIsMultimodal = np.append(self.stimIsMultimodal, '+' in stim)
+            if 'distract' in self.taskVersion:
+                otherModalGo = stim in ('vis1', 'sound1')
+            else:
+                otherModalGo = stim in self.blockStimRewarded
+            self.stimIsOtherModalGo = np.append(self.stimIsOtherModalGo, otherModalGo)
+        return self.stimCodes[stim]
+
+    def update(self, final=False):
+        """Reads data appended to the behavior file since the last update.
+
+        Pass final=True once the task has finished writing the file, so every
+        remaining lick raster row is completed without waiting for later licks
+        or frames. Returns the number of new trials.
+        """
+        d = self.h5
+        for name in perFrameDatasets + perTrialDatasets + eventDatasets:
+            d[name].refresh()
+
+        nFrames = self.frameTimes.size - 1
+        newFrameIntervals = d['frameIntervals'][nFrames:]
+        if newFrameIntervals.size > 0:
+            self.frameTimes = np.concatenate((self.frameTimes, self.frameTimes[-1] + np.cumsum(newFrameIntervals)))
+
+        # a trial is complete once every per-trial dataset has it and its frames have been written
+        nTrials = min(d[name].shape[0] for name in perTrialDatasets)
+        trialEndFrame = d['trialEndFrame'][self.nTrials:nTrials]
+        nTrials = self.nTrials + int(np.sum(trialEndFrame < self.frameTimes.size))
+        newTrials = nTrials - self.nTrials
+        if newTrials > 0:
+            self.updateTrials(slice(self.nTrials, nTrials))
+        self.updateRewards()
+        self.updateLicks(final)
+        return newTrials
+
+    def updateTrials(self, trials):
+        d = self.h5
+        frameTimes = self.frameTimes
+
+        trialStim = d['trialStim'].asstr()[trials]
+        trialStimCode = np.array([self.getStimCode(stim) for stim in trialStim], dtype=int)
+        trialBlock = d['trialBlock'][trials]
+        rewardedStimCode = self.blockStimRewardedCode[trialBlock-1]
+        stimStartFrame = d['trialStimStartFrame'][trials]
+        stimStartTimes = frameTimes[stimStartFrame]
+        trialRepeat = d['trialRepeat'][trials]
+        trialResponse = d['trialResponse'][trials]
+        trialResponseFrame = d['trialResponseFrame'][trials]
+        autoRewardScheduled = d['trialAutoRewardScheduled'][trials]
+
+        responseTimes = np.full(trialResponse.size, np.nan)
+        responseTimes[trialResponse] = frameTimes[trialResponseFrame[trialResponse].astype(int)] - stimStartTimes[trialResponse]
+
+        catchTrials = self.stimIsCatch[trialStimCode]
+        goTrials = (trialStimCode == rewardedStimCode) & (~autoRewardScheduled)
+        nogoTrials = (trialStimCode != rewardedStimCode) & (~catchTrials) & (~self.stimIsMultimodal[trialStimCode])
+        sameModalNogoTrials = nogoTrials & (self.stimModalityCode[trialStimCode] == self.stimModalityCode[rewardedStimCode])
+        otherModalGoTrials = nogoTrials & self.stimIsOtherModalGo[trialStimCode]
+        otherModalNogoTrials = nogoTrials & ~sameModalNogoTrials & ~otherModalGoTrials
+
+        # a trial's engagement depends only on go trials up to and including it
+        engagedTrials = np.ones(trialResponse.size, dtype=bool)
+        for i in range(trialResponse.size):
+            if goTrials[i]:
+                self.recentGoResponses.append(trialResponse[i])
+                self.goTrialCount += 1
+                self.engaged = not (self.goTrialCount > self.engagedThresh and sum(self.recentGoResponses) < 1)
+            engagedTrials[i] = self.engaged
+
+        hitTrials = goTrials & trialResponse
+        falseAlarmTrials = nogoTrials & trialResponse
+        blockTrials = engagedTrials & (~trialRepeat)
+        blockIndex = trialBlock[blockTrials] - 1
+        for name, trialType in (('catch', catchTrials),
+                                ('catchResponse', catchTrials & trialResponse),
+                                ('go', goTrials),
+                                ('hit', hitTrials),
+                                ('nogo', nogoTrials),
+                                ('falseAlarm', falseAlarmTrials),
+                                ('sameModal', sameModalNogoTrials),
+                                ('sameModalFalseAlarm', sameModalNogoTrials & trialResponse),
+                                ('otherModalGo', otherModalGoTrials),
+                                ('otherModalGoFalseAlarm', otherModalGoTrials & trialResponse),
+                                ('otherModalNogo', otherModalNogoTrials),
+                                ('otherModalNogoFalseAlarm', otherModalNogoTrials & trialResponse)):
+            np.add.at(self.blockCounts[name], blockIndex, trialType[blockTrials])
+
+        for name, new in (('trialStim', trialStim),
+                          ('trialStimCode', trialStimCode),
+                          ('trialBlock', trialBlock),
+                          ('trialStartTimes', frameTimes[d['trialStartFrame'][trials]]),
+                          ('stimStartTimes', stimStartTimes),
+                          ('trialRepeat', trialRepeat),
+                          ('trialResponse', trialResponse),
+                          ('trialRewarded', d['trialRewarded'][trials]),
+                          ('autoRewarded', d['trialAutoRewarded'][trials]),
+                          ('responseTimes', responseTimes),
+                          ('engagedTrials', engagedTrials),
+                          ('catchTrials', catchTrials),
+                          ('goTrials', goTrials),
+                          ('nogoTrials', nogoTrials),
+                          ('sameModalNogoTrials', sameModalNogoTrials),
+                          ('otherModalGoTrials', otherModalGoTrials),
+                          ('otherModalNogoTrials', otherModalNogoTrials),
+                          ('hitTrials', hitTrials),
+                          ('falseAlarmTrials', falseAlarmTrials)):
+            setattr(self, name, np.concatenate((getattr(self, name), new)))
+        self.nTrials = self.trialStim.size
+        self.updateBlockMetrics()
+
+    def updateBlockMetrics(self):
+        """Computes block metrics from the accumulated per-block counts for blocks started so far."""
+        c = self.blockCounts
+        nBlocks = self.trialBlock.max() if self.nTrials > 0 else 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.catchResponseRate = list(c['catchResponse'][:nBlocks] / c['catch'][:nBlocks])
+            self.hitRate = list(c['hit'][:nBlocks] / c['go'][:nBlocks])
+            self.hitCount = list(c['hit'][:nBlocks])
+            self.falseAlarmRate = list(c['falseAlarm'][:nBlocks] / c['nogo'][:nBlocks])
+            self.falseAlarmSameModal = list(c['sameModalFalseAlarm'][:nBlocks] / c['sameModal'][:nBlocks])
+            self.falseAlarmOtherModalGo = list(c['otherModalGoFalseAlarm'][:nBlocks] / c['otherModalGo'][:nBlocks])
+            self.falseAlarmOtherModalNogo = list(c['otherModalNogoFalseAlarm'][:nBlocks] / c['otherModalNogo'][:nBlocks])
+            self.dprimeSameModal = [calcDprime(*args) for args in zip(self.hitRate, self.falseAlarmSameModal, c['go'], c['sameModal'])]
+            self.dprimeOtherModalGo = [calcDprime(*args) for args in zip(self.hitRate, self.falseAlarmOtherModalGo, c['go'], c['otherModalGo'])]
+            self.dprimeNonrewardedModal = [calcDprime(*args) for args in zip(self.falseAlarmOtherModalGo, self.falseAlarmOtherModalNogo, c['otherModalGo'], c['otherModalNogo'])]
+
+    def updateRewards(self):
+        d = self.h5
+        nRewards = self.rewardTimes.size
+        nWritten = min(d['rewardFrames'].shape[0], d['rewardSize'].shape[0])
+        rewardFrames = d['rewardFrames'][nRewards:nWritten]
+        rewardFrames = rewardFrames[rewardFrames < self.frameTimes.size]
+        if rewardFrames.size > 0:
+            rewardSize = d['rewardSize'][nRewards:nRewards+rewardFrames.size]
+            prevVolume = self.cumulativeRewardSize[-1] if nRewards > 0 else 0
+            self.rewardTimes = np.concatenate((self.rewardTimes, self.frameTimes[rewardFrames]))
+            self.cumulativeRewardSize = np.concatenate((self.cumulativeRewardSize, prevVolume + np.cumsum(rewardSize)))
+
+        # cumulative reward count and volume per trial, as in generate_cumulative_reward_count/volume
+        nDone = self.cumulativeRewardCount.size
+        if self.nTrials > nDone:
+            prevCount = self.cumulativeRewardCount[-1] if nDone > 0 else 0
+            count = prevCount + np.cumsum(self.trialRewarded[nDone:])
+            self.cumulativeRewardCount = np.concatenate((self.cumulativeRewardCount, count))
+
+        # a trial's volume is pending until the rewards it counts have been read, so
+        # cumulativeVolume can lag behind cumulativeRewardCount by the trials still waiting
+        count = self.cumulativeRewardCount[self.cumulativeVolume.size:]
+        count = count[count <= self.cumulativeRewardSize.size]  # counts only grow, so pending trials are the last ones
+        volume = np.zeros(count.size)
+        volume[count > 0] = self.cumulativeRewardSize[count[count > 0]-1]
+        self.cumulativeVolume = np.concatenate((self.cumulativeVolume, volume))
+
+    def updateLicks(self, final=False):
+        d = self.h5
+        lickFrames = d['lickFrames'][self.nLickFrames:]
+        lickFrames = lickFrames[lickFrames < self.frameTimes.size]
+        if lickFrames.size > 0:
+            self.nLickFrames += lickFrames.size
+            lickTimesDetected = self.frameTimes[lickFrames]
+            isLick = np.diff(np.concatenate(([self.lastLickTimeDetected], lickTimesDetected))) > self.minLickInterval
+            self.lastLickTimeDetected = lickTimesDetected[-1]
+            self.lickTimes = np.concatenate((self.lickTimes, lickTimesDetected[isLick]))
+
+        # licks can be written after the frames they happened in, so a raster row is final once
+        # a later lick has been read, or the frames are lickWriteDelay past the end of its window
+        if final:
+            finalTime = np.inf
+        else:
+            finalTime = max(np.nextafter(self.lastLickTimeDetected, -np.inf), self.frameTimes[-1] - self.lickWriteDelay)
+        for st in self.stimStartTimes[len(self.lickRaster):]:
+            if st + self.postTime > finalTime:
+                break
+            start = np.searchsorted(self.lickTimes, st - self.preTime, side='left')
+            stop = np.searchsorted(self.lickTimes, st + self.postTime, side='right')
+            self.lickRaster.append(self.lickTimes[start:stop] - st)
+
+    def close(self):
+        self.h5.close()
+
+
+class LiveSessionMonitor():
+    """Lick raster, cumulative rewards and block metrics figure for a LiveDynRoutData.
+
+    `update` only draws raster rows and rewards added since the previous call.
+    """
+
+    def __init__(self, obj: LiveDynRoutData):
+        self.obj = obj
+        self.nRasterRows = 0
+        self.nRewards = 0
+
+        self.fig = plt.figure(figsize=(10, 8))
+        gs = matplotlib.gridspec.GridSpec(4, 2)
+        self.rasterAx = ax = self.fig.add_subplot(gs[:, 0])
+        ax.add_patch(matplotlib.patches.Rectangle([-obj.quiescentFrames/obj.frameRate, 0], width=obj.quiescentFrames /
+                     obj.frameRate, height=1e4, facecolor='r', edgecolor=None, alpha=0.2, zorder=0))
+        ax.add_patch(matplotlib.patches.Rectangle([obj.responseWindowTime[0], 0], width=np.diff(
+            obj.responseWindowTime)[0], height=1e4, facecolor='g', edgecolor=None, alpha=0.2, zorder=0))
+        ax.set_xlim([-obj.preTime, obj.postTime])
+        ax.set_xlabel('time from stimulus onset (s)')
+        ax.set_ylabel('trial')
+
+        self.rewardAx = ax = self.fig.add_subplot(gs[:2, 1])
+        self.rewardLine, = ax.plot([], [], 'b')
+        ax.set_xlabel('trials')
+        ax.set_ylabel('cumulative reward count')
+
+        self.metricsAx = ax = self.fig.add_subplot(gs[2:, 1])
+        ax.axis('off')
+        self.metricsText = ax.text(0, 1, '', va='top', family='monospace', fontsize=8)
+
+        for ax in (self.rasterAx, self.rewardAx):
+            for side in ('right', 'top'):
+                ax.spines[side].set_visible(False)
+            ax.tick_params(direction='out', top=False, right=False)
+        self.update()
+        self.fig.tight_layout()
+
+    def update(self):
+        obj = self.obj
+        ax = self.rasterAx
+        for i in range(self.nRasterRows, len(obj.lickRaster)):
+            if not obj.engagedTrials[i]:
+                ax.add_patch(matplotlib.patches.Rectangle(
+                    [-obj.preTime, i+0.5], width=obj.preTime+obj.postTime, height=1, facecolor='0.5', edgecolor=None, alpha=0.2, zorder=0))
+            ax.vlines(obj.lickRaster[i], i+0.5, i+1.5, colors='k')
+        # rewards can be read after their trial's row is final, so new rows get every
+        # reward read so far and rows drawn before only the rewards read since
+        self.drawRewards(range(self.nRasterRows, len(obj.lickRaster)), obj.rewardTimes)
+        self.drawRewards(range(self.nRasterRows), obj.rewardTimes[self.nRewards:])
+        self.nRasterRows = len(obj.lickRaster)
+        self.nRewards = obj.rewardTimes.size
+        ax.set_ylim([0.5, max(self.nRasterRows, 1)+0.5])
+        ax.set_title(obj.subjectName + ', ' + obj.rigName + '\n' + 'trials (n=' + str(obj.nTrials) +
+                     '), engaged (n=' + str(obj.engagedTrials.sum()) + ', not gray)')
+
+        self.rewardLine.set_data(np.arange(obj.cumulativeRewardCount.size), obj.cumulativeRewardCount)
+        self.rewardAx.set_xlim([0, max(obj.nTrials, 1)])
+        self.rewardAx.set_ylim([0, max(obj.cumulativeRewardCount[-1] if obj.nTrials > 0 else 0, 1)*1.05])
+
+        lines = ['block  go      hit    FA same  dprime same  dprime other']
+        for i in range(len(obj.hitRate)):
+            lines.append(f'{i+1:<6} {obj.blockStimRewarded[i]:<7} {obj.hitRate[i]:<6.2f} {obj.falseAlarmSameModal[i]:<8.2f} '
+                         f'{obj.dprimeSameModal[i]:<12.2f} {obj.dprimeOtherModalGo[i]:.2f}')
+        self.metricsText.set_text('\n'.join(lines))
+        self.fig.canvas.draw_idle()
+
+    def drawRewards(self, rows, rewardTimes):
+        obj = self.obj
+        if rewardTimes.size == 0:
+            return
+        for i in rows:
+            if obj.trialRewarded[i]:
+                rt = rewardTimes - obj.stimStartTimes[i]
+                trialRewardTime = rt[(rt > 0) & (rt <= obj.postTime)]
+                if trialRewardTime.size > 0:
+                    mfc = 'b' if obj.autoRewarded[i] else 'none'
+                    self.rasterAx.plot(trialRewardTime, i+1, 'o', mec='b', mfc=mfc, ms=4)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("behavior_filepath", type=str)
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between polls of the behavior file")
+
+    args = parser.parse_args()
+
+    obj = LiveDynRoutData()
+    obj.openBehavData(args.behavior_filepath)
+    obj.update()
+    monitor = LiveSessionMonitor(obj)
+    try:
+        while plt.fignum_exists(monitor.fig.number):
+            t = time.perf_counter()
+            nRasterRows = len(obj.lickRaster)
+            nRewards = obj.rewardTimes.size
+            # raster rows and rewards can be completed without a new trial ending
+            if obj.update() > 0 or len(obj.lickRaster) > nRasterRows or obj.rewardTimes.size > nRewards:
+                monitor.update()
+            plt.pause(max(args.interval - (time.perf_counter() - t), 0.01))
+    finally:
+        obj.close()
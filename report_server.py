@@ -0,0 +1,385 @@
+import io
+import os
+import ast
+import json
+import time
+import zlib
+import inspect
+import threading
+import collections
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Hashable, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import matplotlib
+matplotlib.use("Agg")  # figures are only ever rendered to bytes
+
+import generate_plots
+import generate_metrics
+
+
+content_types = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+}
+
+
+class LRUCache:
+    """Thread safe least-recently-used cache with an optional time to live.
+
+    Counts hits and misses. Values can be futures, so concurrent requests for
+    the same key share one computation instead of each starting their own.
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: "collections.OrderedDict[Hashable, Tuple[float, Any]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns (value, hit), calling `factory` to create the value on a miss.
+
+        `factory` runs while the cache is locked, so it should be quick, e.g.
+        submit work to an executor and return the future.
+        """
+        with self._lock:
+            if key in self._items:
+                created, value = self._items[key]
+                if self.ttl is None or time.monotonic() - created < self.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value, True
+                del self._items[key]
+            self.misses += 1
+            value = factory()
+            self._items[key] = (time.monotonic(), value)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+            return value, False
+
+    def discard(self, key: Hashable, value: Any = None):
+        """Removes `key`, only if it still maps to `value` when one is given."""
+        with self._lock:
+            if key in self._items and (value is None or self._items[key][1] is value):
+                del self._items[key]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+# loaded DynRoutData sessions of a render worker process, see init_render_worker
+worker_sessions: LRUCache = None
+
+
+def init_render_worker(max_sessions: int):
+    global worker_sessions
+    worker_sessions = LRUCache(max_sessions)
+
+
+# generate_* functions drawing one figure per block -> (calc_*_data, plot_* taking the data and a block index)
+block_figure_functions = {
+    "generate_run_speed_mean_block": ("calc_run_speed_mean_block_data", "plot_run_speed_mean_block"),
+}
+
+
+def render_figure(behavior_filepath: str, function_name: str, params: Dict, image_format: str,
+                  block: int = None) -> Tuple[bytes, bool]:
+    """Renders a generate_* figure in a render worker, reusing the worker's loaded sessions.
+
+    For functions in `block_figure_functions`, `block` (from 1) selects the
+    block's figure, otherwise the function's own figure (the last block's)
+    is rendered. Returns (image bytes or None if the function produced no
+    figure, whether the session was already loaded in this worker).
+    """
+    import matplotlib.pyplot as plt
+
+    stat = os.stat(behavior_filepath)
+    obj, session_hit = worker_sessions.get_or_create(
+        (behavior_filepath, stat.st_mtime_ns, stat.st_size),
+        lambda: generate_plots.getBehavData(behavior_filepath),
+    )
+    try:
+        if block is None:
+            fig = getattr(generate_plots, function_name)(obj, **params)
+        else:
+            calc_function_name, plot_function_name = block_figure_functions[function_name]
+            data = getattr(generate_plots, calc_function_name)(obj, **params)
+            if data is not None and not 1 <= block <= len(data["blocks"]):
+                raise ValueError("Session has %d blocks. block=%d" % (len(data["blocks"]), block))
+            fig = None if data is None else getattr(generate_plots, plot_function_name)(data, block - 1)
+        if fig is None:
+            return None, session_hit
+        image = io.BytesIO()
+        fig.savefig(image, format=image_format)
+        return image.getvalue(), session_hit
+    finally:
+        plt.close("all")
+
+
+class ReportServer(ThreadingHTTPServer):
+    """Local http server for session figures and mtrain tables with warm in-memory caches.
+
+    Figures render in single-process workers (pyplot is not thread safe),
+    and each worker keeps its own `max_sessions` recently loaded sessions. A
+    session's figures are spread over `session_workers` of the workers, picked
+    by a hash of its path, with each figure function always rendering in the
+    same one of them. So a slow figure only holds up the figures queued
+    behind it in its worker, a session is loaded by at most `session_workers`
+    workers, and at most `render_workers * max_sessions` sessions are in
+    memory. Rendered images and mtrain training histories are cached in this
+    process.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], data_dir: str, api_base: str = None,
+                 render_workers: int = None, session_workers: int = 2, max_sessions: int = 8, max_figures: int = 256,
+                 max_histories: int = 64, history_ttl: float = 600):
+        super().__init__(address, ReportRequestHandler)
+        self.data_dir = os.path.abspath(data_dir)
+        self.api_base = api_base
+        self.render_pools = [
+            concurrent.futures.ProcessPoolExecutor(1, initializer=init_render_worker, initargs=(max_sessions, ))
+            for _ in range(render_workers or os.cpu_count() or 1)
+        ]
+        self.session_workers = max(1, min(session_workers, len(self.render_pools)))
+        self.history_pool = concurrent.futures.ThreadPoolExecutor(4)
+        self.figures = LRUCache(max_figures)
+        self.histories = LRUCache(max_histories, ttl=history_ttl)
+        self.session_hits = 0
+        self.session_misses = 0
+        self._stats_lock = threading.Lock()
+
+    def resolve_session(self, session: str) -> str:
+        """Path of a behavior file in data_dir, refusing paths outside of it."""
+        path = os.path.realpath(os.path.join(self.data_dir, session))
+        if os.path.commonpath([path, self.data_dir]) != self.data_dir:
+            raise PermissionError("Session is outside of the data directory. session=%s" % session)
+        if not os.path.isfile(path):
+            raise FileNotFoundError("Session not found. session=%s" % session)
+        return path
+
+    def render_pool(self, path: str, function_name: str) -> concurrent.futures.ProcessPoolExecutor:
+        """The worker that renders `function_name` figures of the session at `path`.
+
+        Consecutive workers from the one picked by the path's hash serve the
+        session, one of them per function.
+        """
+        first = zlib.crc32(path.encode("utf8"))
+        offset = zlib.crc32(function_name.encode("utf8")) % self.session_workers
+        return self.render_pools[(first + offset) % len(self.render_pools)]
+
+    def figure(self, session: str, function_name: str, params: Dict, image_format: str,
+               block: int = None) -> bytes:
+        path = self.resolve_session(session)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size, function_name,
+               json.dumps(params, sort_keys=True, default=repr), image_format, block)
+
+        def submit_render():
+            future = self.render_pool(path, function_name).submit(
+                render_figure, path, function_name, params, image_format, block)
+            future.add_done_callback(self.count_session)
+            return future
+
+        future, _ = self.figures.get_or_create(key, submit_render)
+        try:
+            image, _ = future.result()
+        except Exception:
+            self.figures.discard(key, future)  # don't cache failures
+            raise
+        return image
+
+    def count_session(self, future: concurrent.futures.Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._stats_lock:
+            if future.result()[1]:
+                self.session_hits += 1
+            else:
+                self.session_misses += 1
+
+    def mtrain_table(self, subject_id: str, session_id: str) -> str:
+        """Training history table from the mtrain at api_base, the only host the server sends requests to."""
+        if self.api_base is None:
+            raise KeyError("No mtrain api_base configured, start the server with --api-base.")
+        key = (subject_id, session_id)
+        future, _ = self.histories.get_or_create(
+            key,
+            lambda: self.history_pool.submit(
+                generate_metrics.get_mtrain_training_history, self.api_base, subject_id, session_id),
+        )
+        try:
+            training_history = future.result()
+        except Exception:
+            self.histories.discard(key, future)
+            raise
+        return generate_metrics.generate_training_history_table(training_history)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            total = self.session_hits + self.session_misses
+            sessions = {
+                "hits": self.session_hits,
+                "misses": self.session_misses,
+                "hit_rate": self.session_hits / total if total else 0.0,
+            }
+        return {
+            "figures": self.figures.stats(),
+            "sessions": sessions,
+            "training_histories": self.histories.stats(),
+            "mtrain_http": generate_metrics.http_cache.stats() if generate_metrics.http_cache is not None else None,
+        }
+
+    def server_close(self):
+        super().server_close()
+        for render_pool in self.render_pools:
+            render_pool.shutdown(cancel_futures=True)
+        self.history_pool.shutdown(cancel_futures=True)
+
+
+plot_function_names = tuple(func.__name__ for func in generate_plots.plot_functions)
+
+
+def parse_params(query: Dict[str, list], exclude: Tuple[str, ...]) -> Dict:
+    """Query string values as python literals where possible, e.g. preTime=2 -> 2."""
+    params = {}
+    for name, values in query.items():
+        if name in exclude:
+            continue
+        try:
+            params[name] = ast.literal_eval(values[-1])
+        except (ValueError, SyntaxError):
+            params[name] = values[-1]
+    return params
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """Routes
+
+    - /figures/<generate_* function name>?session=<behavior file in data_dir>&format=png&<function params>,
+      with &block=<block number from 1> for functions drawing one figure per block
+    - /mtrain_table?subject_id=...&session_id=..., from the mtrain at the server's api_base
+    - /stats
+    """
+
+    server: ReportServer
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path.startswith("/figures/"):
+                self.get_figure(url.path[len("/figures/"):], query)
+            elif url.path == "/mtrain_table":
+                self.get_mtrain_table(query)
+            elif url.path == "/stats":
+                self.send_body(200, "application/json", json.dumps(self.server.stats()).encode("utf8"))
+            else:
+                self.send_error(404, "Unknown route. path=%s" % url.path)
+        except (KeyError, ValueError, TypeError) as e:
+            self.send_error(400, str(e))
+        except PermissionError as e:
+            self.send_error(403, str(e))
+        except FileNotFoundError as e:
+            self.send_error(404, str(e))
+        except Exception as e:
+            self.send_error(500, repr(e))
+
+    def get_figure(self, function_name: str, query: Dict[str, list]):
+        if function_name not in plot_function_names:
+            self.send_error(404, "Unknown figure. name=%s" % function_name)
+            return
+        if "session" not in query:
+            raise KeyError("Missing session parameter.")
+        image_format = query.get("format", ["png"])[-1]
+        if image_format not in content_types:
+            raise ValueError("Unsupported format. format=%s" % image_format)
+        params = parse_params(query, exclude=("session", "format", "block"))
+        if params.get("return_data"):
+            raise ValueError("Only figures are served, return_data can't be set.")
+        block = None
+        if "block" in query:
+            if function_name not in block_figure_functions:
+                raise ValueError("%s draws a single figure, block can't be set." % function_name)
+            block = int(query["block"][-1])
+        # raises TypeError for parameters the function doesn't take
+        inspect.signature(getattr(generate_plots, function_name)).bind(None, **params)
+        image = self.server.figure(query["session"][-1], function_name, params, image_format, block)
+        if image is None:
+            self.send_body(204, content_types[image_format], b"")
+        else:
+            self.send_body(200, content_types[image_format], image)
+
+    def get_mtrain_table(self, query: Dict[str, list]):
+        # clients can't choose the host the server sends requests to
+        if "api_base" in query and query["api_base"][-1] != self.server.api_base:
+            raise ValueError("api_base can't be set per request, only with --api-base.")
+        html = self.server.mtrain_table(query["subject_id"][-1], query["session_id"][-1])
+        self.send_body(200, "text/html; charset=utf-8", html.encode("utf8"))
+
+    def send_body(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_dir", type=str, help="directory of behavior files that can be served")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--api-base", type=str, default=None,
+                        help="mtrain api base used by /mtrain_table, e.g. http://mtrain:80")
+    parser.add_argument("--render-workers", type=int, default=None)
+    parser.add_argument("--session-workers", type=int, default=2,
+                        help="render workers a session's figures are spread over, each one loads the session")
+    parser.add_argument("--max-sessions", type=int, default=8,
+                        help="loaded sessions kept by each render worker")
+    parser.add_argument("--max-figures", type=int, default=256)
+    parser.add_argument("--max-histories", type=int, default=64)
+    parser.add_argument("--history-ttl", type=float, default=600,
+                        help="seconds a training history is reused before it's fetched from mtrain again")
+    parser.add_argument("--http-cache-dir", type=str, default=None,
+                        help="on-disk cache of mtrain responses, revalidated with ETag / If-Modified-Since")
+
+    args = parser.parse_args()
+
+    if args.http_cache_dir is not None:
+        generate_metrics.use_http_cache(generate_metrics.make_mtrain_http_cache(args.http_cache_dir))
+
+    server = ReportServer(
+        (args.host, args.port),
+        args.data_dir,
+        api_base=args.api_base,
+        render_workers=args.render_workers,
+        session_workers=args.session_workers,
+        max_sessions=args.max_sessions,
+        max_figures=args.max_figures,
+        max_histories=args.max_histories,
+        history_ttl=args.history_ttl,
+    )
+    print("Serving on http://%s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,165 @@
+import os
+import json
+import math
+import concurrent.futures
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # figures are only written to disk
+
+import generate_plots
+from behavior_metrics import calcTrialQuiescentViolations
+
+
+# figure data holding a value per frame, left out of report.json unless asked for
+# since it grows with session length, running_speed_binned has the same trace binned
+per_frame_data = ("running_speed", )
+
+
+def to_json_compatible(value: Any) -> Any:
+    """numpy arrays and scalars as lists and python numbers, with nan and inf as None."""
+    if isinstance(value, dict):
+        return {str(key): to_json_compatible(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_json_compatible(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def render_report_figure(plot_function_name: str, data: Dict, args: Tuple, image_path: str,
+                         image_format: str, dpi: Optional[int]) -> str:
+    """Draws one figure from its data with a generate_plots plot_* function and saves it, in a worker process."""
+    import matplotlib.pyplot as plt
+
+    try:
+        fig = getattr(generate_plots, plot_function_name)(data, *args)
+        fig.savefig(image_path, format=image_format, dpi=dpi)
+    finally:
+        plt.close("all")
+    return image_path
+
+
+class SessionReport:
+    """Every generate_plots figure of one session, drawn from data computed once.
+
+    The session is loaded once and the data behind each figure is computed
+    in a single pass over it, sharing intermediates such as per-trial
+    quiescent violations. Figures are then drawn concurrently in worker
+    processes, one Agg figure per task, and written with a JSON of the
+    same data (per-frame series only on request, see `per_frame_data`).
+    """
+
+    def __init__(self, behavior_filepath, pre_time: float = 4, post_time: float = 4,
+                 bin_size: int = 60, window_size: int = 10):
+        self.obj = generate_plots.getBehavData(behavior_filepath, runningSpeedBinSize=bin_size)
+        self.pre_time = pre_time
+        self.post_time = post_time
+        self.bin_size = bin_size
+        self.window_size = window_size
+        self.data = self.compute()
+
+    def compute(self) -> Dict[str, Optional[Dict]]:
+        """Data of each figure by name, None for figures the session has no data for."""
+        obj = self.obj
+        trialQuiescentViolations = calcTrialQuiescentViolations(obj)
+        return {
+            "lick_raster_all_trials": generate_plots.calc_lick_raster_all_trials_data(
+                obj, self.pre_time, self.post_time),
+            "lick_latency": generate_plots.calc_lick_latency_data(obj),
+            "run_speed_mean_block": generate_plots.calc_run_speed_mean_block_data(
+                obj, self.pre_time, self.post_time),
+            "frame_intervals": generate_plots.calc_frame_intervals_data(obj),
+            "quiescent_violations": generate_plots.calc_quiescent_violations_data(
+                obj, trialQuiescentViolations),
+            "inter_trial_intervals": generate_plots.calc_inter_trial_intervals_data(
+                obj, trialQuiescentViolations),
+            "running_speed": generate_plots.calc_running_speed_data(obj),
+            "running_speed_binned": generate_plots.calc_running_speed_binned_data(obj, self.bin_size),
+            "cumulative_volume": generate_plots.calc_cumulative_volume_data(obj),
+            "cumulative_reward_count": generate_plots.calc_cumulative_reward_count_data(obj),
+            "rolling_performance": generate_plots.calc_rolling_performance_data(obj, self.window_size),
+        }
+
+    def figures(self) -> List[Tuple[str, str, str, Tuple]]:
+        """(figure name, plot function name, data name, extra plot arguments) of each figure to draw."""
+        figures = []
+        for name, data in self.data.items():
+            if data is None:
+                continue
+            if name == "run_speed_mean_block":
+                figures.extend(
+                    (f"{name}_{block_ind + 1}", f"plot_{name}", name, (block_ind, ))
+                    for block_ind in range(len(data["blocks"]))
+                )
+            else:
+                figures.append((name, f"plot_{name}", name, ()))
+        return figures
+
+    def render(self, output_dir: str, image_format: str = "png", dpi: Optional[int] = None,
+               workers: Optional[int] = None) -> Dict[str, str]:
+        """Draws every figure into output_dir in parallel, returns the image path of each figure name."""
+        os.makedirs(output_dir, exist_ok=True)
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = {
+                figure_name: pool.submit(
+                    render_report_figure, plot_function_name, self.data[data_name], args,
+                    os.path.join(output_dir, f"{figure_name}.{image_format}"), image_format, dpi,
+                )
+                for figure_name, plot_function_name, data_name, args in self.figures()
+            }
+            return {figure_name: future.result() for figure_name, future in futures.items()}
+
+    def to_json(self, per_frame: bool = False) -> Dict:
+        """Report parameters and figure data, without the per-frame series unless `per_frame` is True."""
+        figures = {name: data for name, data in self.data.items() if per_frame or name not in per_frame_data}
+        return {
+            "session": os.path.basename(self.obj.behavDataPath),
+            "subject": self.obj.subjectName,
+            "parameters": {
+                "pre_time": self.pre_time,
+                "post_time": self.post_time,
+                "bin_size": self.bin_size,
+                "window_size": self.window_size,
+            },
+            "figures": to_json_compatible(figures),
+        }
+
+    def write(self, output_dir: str, image_format: str = "png", dpi: Optional[int] = None,
+              workers: Optional[int] = None, per_frame: bool = False) -> Dict[str, str]:
+        """Renders the figures and writes report.json next to them, returns the path of each output."""
+        paths = self.render(output_dir, image_format, dpi, workers)
+        paths["report"] = os.path.join(output_dir, "report.json")
+        with open(paths["report"], "w") as f:
+            json.dump(self.to_json(per_frame), f, allow_nan=False)
+        return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("behavior_filepath", type=str)
+    parser.add_argument("output_dir", type=str)
+    parser.add_argument("--format", type=str, default="png")
+    parser.add_argument("--dpi", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="render processes, defaults to the number of cpus")
+    parser.add_argument("--pre-time", type=float, default=4)
+    parser.add_argument("--post-time", type=float, default=4)
+    parser.add_argument("--bin-size", type=int, default=60,
+                        help="frames per running speed bin")
+    parser.add_argument("--window-size", type=int, default=10,
+                        help="trials per rolling performance window")
+    parser.add_argument("--per-frame", action="store_true",
+                        help="include per-frame series (running speed) in report.json")
+
+    args = parser.parse_args()
+
+    report = SessionReport(args.behavior_filepath, args.pre_time, args.post_time,
+                           args.bin_size, args.window_size)
+    for name, path in report.write(args.output_dir, args.format, args.dpi, args.workers, args.per_frame).items():
+        print(name, path)
@@ -0,0 +1,101 @@
+import os
+import h5py
+import numpy as np
+
+
+# per-frame datasets and event datasets whose values are frame indices
+perFrameDatasets = ('frameIntervals', 'rotaryEncoderCount', 'rotaryEncoderIndex')
+frameIndexDatasets = (
+    'lickFrames',
+    'rewardFrames',
+    'manualRewardFrames',
+    'quiescentViolationFrames',
+    'trialEndFrame',
+    'trialStartFrame',
+    'trialStimStartFrame',
+    'trialResponseFrame',
+)
+eventDatasets = ('lickFrames', 'rewardFrames', 'rewardSize', 'manualRewardFrames', 'quiescentViolationFrames')
+cumulativeDatasets = ('rotaryEncoderCount', )
+
+
+def generate_synthetic_session(template_filepath: str, output_filepath: str, scale: int = 1) -> str:
+    """Writes a DynamicRouting1 behavior file with `scale` times the trials and frames of a template session.
+
+    The template's frames, trials, blocks and events are repeated back to back,
+    with frame indices, block numbers and cumulative counts offset for each
+    repeat, so the output loads with DynRoutData like a real (longer) session.
+    Session parameters are copied unchanged.
+
+    Returns `output_filepath`.
+    """
+    src = h5py.File(template_filepath, 'r')
+    nFrames = src['frameIntervals'].shape[0]
+    nTrials = src['trialEndFrame'].shape[0]
+    nBlocks = src['blockStimRewarded'].shape[0]
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+    dst = h5py.File(output_filepath, 'w')
+    for key, item in src.items():
+        if isinstance(item, h5py.Group):
+            src.copy(item, dst, name=key)
+            continue
+        if item.shape is None or item.ndim == 0 or item.shape[0] == 0:
+            src.copy(item, dst, name=key)
+            continue
+        data = item[()]
+        if key in perFrameDatasets or key in eventDatasets:
+            # per-frame datasets may have one extra sample for the final frame
+            n = nFrames if key in perFrameDatasets else data.shape[0]
+            reps = []
+            for i in range(scale):
+                rep = data[:n].copy()
+                if key in frameIndexDatasets:
+                    rep += i * nFrames
+                if key in cumulativeDatasets:
+                    rep += i * (data[n-1] - data[0])
+                reps.append(rep)
+            if key in perFrameDatasets and data.shape[0] > n:
+                last = data[n:].copy()
+                if key in cumulativeDatasets:
+                    last += (scale-1) * (data[n-1] - data[0])
+                reps.append(last)
+            data = np.concatenate(reps)
+        elif key.startswith('trial') and data.shape[0] in (nTrials, nTrials+1):
+            # per-trial datasets may have one extra entry for the unfinished final trial
+            reps = []
+            for i in range(scale):
+                rep = data[:nTrials].copy()
+                if key in frameIndexDatasets:
+                    rep = rep + i * nFrames
+                if key == 'trialBlock':
+                    rep += i * nBlocks
+                reps.append(rep)
+            if data.shape[0] > nTrials:
+                last = data[nTrials:].copy()
+                if key in frameIndexDatasets:
+                    last = last + (scale-1) * nFrames
+                if key == 'trialBlock':
+                    last += (scale-1) * nBlocks
+                reps.append(last)
+            data = np.concatenate(reps)
+        elif data.shape[0] == nBlocks and key.startswith(('block', 'framesPerBlock')):
+            data = np.concatenate([data] * scale)
+        dst.create_dataset(key, data=data, dtype=item.dtype)
+    dst.close()
+    src.close()
+    return output_filepath
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("template_filepath", type=str)
+    parser.add_argument("output_filepath", type=str)
+    parser.add_argument("--scale", type=int, default=1,
+                        help="number of times the template's trials and frames are repeated")
+
+    args = parser.parse_args()
+
+    print(generate_synthetic_session(args.template_filepath, args.output_filepath, args.scale))
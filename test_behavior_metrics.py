@@ -0,0 +1,205 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from behavior_metrics import DynRoutData, calcDprime, calcResponseTimeDistributions, calcRollingPerformance, normPpf
+from live_session import LiveDynRoutData, perFrameDatasets, perTrialDatasets, eventDatasets
+
+
+bundled_filepath = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "DynamicRouting1_674721_20230710_084322.hdf5",
+)
+
+# block metrics of the bundled session as computed before DynRoutData moved to behavior_metrics
+# (scipy's norm.ppf for d-prime)
+bundled_block_metrics = {
+    "catchResponseRate": [0.0, 0.14285714285714285, 0.5, 0.0, 0.0, 0.0],
+    "hitRate": [1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+    "hitCount": [15, 16, 14, 20, 16, 17],
+    "falseAlarmRate": [0.5555555555555556, 0.21428571428571427, 0.6590909090909091,
+                       0.07272727272727272, 0.6170212765957447, 0.1111111111111111],
+    "falseAlarmSameModal": [1.0, 0.05, 1.0, 0.0, 0.9375, 0.0],
+    "falseAlarmOtherModalGo": [0.6666666666666666, 0.35294117647058826, 1.0, 0.15, 0.875, 0.3],
+    "falseAlarmOtherModalNogo": [0.0, 0.2631578947368421, 0.0, 0.05555555555555555, 0.0, 0.0],
+    "dprimeSameModal": [0.0, 3.5075854943731244, -0.031171545076723817,
+                        3.849473944873484, 0.32861132306910523, 3.77901992066686],
+    "dprimeOtherModalGo": [1.4031873365204572, 2.2401238112502053, 0.0,
+                           2.996397374033844, 0.7123824870456437, 2.413910473041471],
+    "dprimeNonrewardedModal": [2.264641935111372, 0.2562480569511472, 3.6366577265551054,
+                               0.5567854285292608, 2.9842640161919225, 1.365109447625389],
+}
+
+
+@pytest.fixture(scope="module")
+def bundled_session():
+    if not h5py.is_hdf5(bundled_filepath):
+        pytest.skip("bundled behavior file is missing or an unpulled lfs pointer")
+    obj = DynRoutData()
+    obj.loadBehavData(bundled_filepath)
+    return obj
+
+
+def test_norm_ppf_matches_scipy():
+    norm = pytest.importorskip("scipy.stats").norm
+    tail_cutoff = 0.02425  # where normPpf switches between its tail and central approximations
+    p = np.concatenate((
+        np.linspace(0, 1, 100001),
+        [0, 1, np.nan, 1e-300, 1e-10, 1-1e-10],
+        [tail_cutoff, np.nextafter(tail_cutoff, 0), np.nextafter(tail_cutoff, 1)],
+        [1-tail_cutoff, np.nextafter(1-tail_cutoff, 0), np.nextafter(1-tail_cutoff, 1)],
+    ))
+    np.testing.assert_allclose(normPpf(p), norm.ppf(p), rtol=1e-14, atol=1e-14)
+    assert normPpf(0) == -np.inf
+    assert normPpf(1) == np.inf
+    assert np.isnan(normPpf(np.nan))
+    assert normPpf(0.5) == 0
+
+
+def test_block_metrics_unchanged(bundled_session):
+    for name, expected in bundled_block_metrics.items():
+        np.testing.assert_allclose(getattr(bundled_session, name), expected, rtol=1e-12, atol=1e-12, err_msg=name)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 777, 1000, 10**7])
+def test_chunked_loading_matches_in_memory(bundled_session, chunk_size):
+    assert bundled_session.nFrames % 777 != 0  # one chunk size leaves a partial last chunk
+    chunked = DynRoutData()
+    chunked.loadBehavData(bundled_filepath, chunkSize=chunk_size)
+    for name in ("stimStartTimes", "lickTimes", "frameIntervalCounts", "runningSpeedBinned", "runningSpeedBinTimes"):
+        np.testing.assert_array_equal(getattr(chunked, name), getattr(bundled_session, name), err_msg=name)
+    assert chunked.longFrameCount == bundled_session.longFrameCount
+    assert chunked.sessionDuration == bundled_session.sessionDuration
+
+
+@pytest.mark.parametrize("group_by_block", [False, True])
+@pytest.mark.parametrize("group_by_engaged", [False, True])
+def test_response_time_distributions_match_reference(bundled_session, group_by_block, group_by_engaged):
+    obj = bundled_session
+    quantiles = (0, 0.1, 0.25, 0.75, 0.9, 1)
+    distributions = calcResponseTimeDistributions(obj, group_by_block, group_by_engaged, quantiles)
+    responded = obj.trialResponse & ~np.isnan(obj.responseTimes)
+    assert sum(dist["n"] for dist in distributions) == responded.sum()
+    for dist in distributions:
+        trials = responded & (obj.trialStim == dist["stim"])
+        if group_by_block:
+            trials &= obj.trialBlock == dist["block"]
+        if group_by_engaged:
+            trials &= obj.engagedTrials == dist["engaged"]
+        rt = np.sort(obj.responseTimes[trials])
+        np.testing.assert_array_equal(dist["responseTimes"], rt)
+        np.testing.assert_allclose(dist["cumProb"], [np.sum(rt <= t)/rt.size for t in rt], rtol=0, atol=1e-15)
+        np.testing.assert_allclose(dist["mean"], rt.mean())
+        np.testing.assert_allclose(dist["median"], np.median(rt), rtol=0, atol=1e-15)
+        assert sorted(dist["quantiles"]) == list(quantiles)
+        for q, value in dist["quantiles"].items():
+            np.testing.assert_allclose(value, np.quantile(rt, q), rtol=0, atol=1e-15)
+
+
+rolling_metrics = ("hitRate", "falseAlarmRate", "falseAlarmSameModal", "falseAlarmOtherModalGo",
+                   "falseAlarmOtherModalNogo", "dprimeSameModal", "dprimeOtherModalGo", "dprimeNonrewardedModal")
+
+
+def test_rolling_performance_of_whole_blocks_matches_block_metrics(bundled_session):
+    obj = bundled_session
+    performance = calcRollingPerformance(obj, windowSize=obj.nTrials)
+    blockLastTrials = np.where(np.diff(np.append(obj.trialBlock, -1)) != 0)[0]
+    for name in rolling_metrics:
+        np.testing.assert_allclose(performance[name][blockLastTrials], getattr(obj, name),
+                                   rtol=1e-12, atol=1e-12, err_msg=name)
+
+
+def test_rolling_performance_matches_brute_force(bundled_session):
+    obj = bundled_session
+    window_size = 10
+    performance = calcRollingPerformance(obj, window_size)
+    counted = obj.engagedTrials & ~obj.trialRepeat
+    for i in range(obj.nTrials):
+        window = np.zeros(obj.nTrials, dtype=bool)
+        window[max(i - obj.blockTrial[i], i - window_size + 1):i+1] = True
+        window &= counted
+        go = obj.goTrials[window].sum()
+        sameModal = (obj.sameModalNogoTrials & window).sum()
+        otherModalGo = (obj.otherModalGoTrials & window).sum()
+        otherModalNogo = (obj.otherModalNogoTrials & window).sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected = {
+                "hitRate": obj.hitTrials[window].sum() / go,
+                "falseAlarmRate": obj.falseAlarmTrials[window].sum() / obj.nogoTrials[window].sum(),
+                "falseAlarmSameModal": obj.falseAlarmTrials[window & obj.sameModalNogoTrials].sum() / sameModal,
+                "falseAlarmOtherModalGo": obj.falseAlarmTrials[window & obj.otherModalGoTrials].sum() / otherModalGo,
+                "falseAlarmOtherModalNogo": obj.falseAlarmTrials[window & obj.otherModalNogoTrials].sum() / otherModalNogo,
+            }
+        expected["dprimeSameModal"] = calcDprime(expected["hitRate"], expected["falseAlarmSameModal"], go, sameModal)
+        expected["dprimeOtherModalGo"] = calcDprime(expected["hitRate"], expected["falseAlarmOtherModalGo"], go, otherModalGo)
+        expected["dprimeNonrewardedModal"] = calcDprime(
+            expected["falseAlarmOtherModalGo"], expected["falseAlarmOtherModalNogo"], otherModalGo, otherModalNogo)
+        for name in rolling_metrics:
+            np.testing.assert_allclose(performance[name][i], expected[name], rtol=1e-12, atol=1e-12,
+                                       err_msg="%s trial %d" % (name, i))
+
+
+def write_growing_session(writer, data, nFrames):
+    """Appends what the task would have written by frame nFrames, with lickFrames and rewardSize lagging."""
+    nTrials = np.sum(data["trialEndFrame"] <= nFrames)
+    finished = nFrames == data["frameIntervals"].size
+    counts = {
+        "frameIntervals": nFrames,
+        "lickFrames": np.sum(data["lickFrames"] <= (nFrames if finished else nFrames - 300)),
+        "rewardFrames": np.sum(data["rewardFrames"] <= nFrames),
+        "rewardSize": np.sum(data["rewardFrames"] <= (nFrames if finished else nFrames - 6000)),
+    }
+    for name in data:
+        n = counts.get(name, min(nTrials + (name == "trialStartFrame"), data[name].size))
+        written = writer[name].shape[0]
+        if n > written:
+            writer[name].resize((n, ))
+            writer[name][written:n] = data[name][written:n]
+    writer.flush()
+
+
+def test_live_session_matches_dynroutdata(bundled_session, tmp_path):
+    growing = perFrameDatasets + perTrialDatasets + eventDatasets
+    live_filepath = str(tmp_path / os.path.basename(bundled_filepath))
+    with h5py.File(bundled_filepath, "r") as src:
+        # SWMR can't read variable-length strings, so the task writes trialStim as fixed-length
+        data = {name: src[name].asstr()[:].astype("S16") if src[name].dtype.kind == "O" else src[name][:]
+                for name in growing}
+        writer = h5py.File(live_filepath, "w", libver="latest")
+        for name, item in src.items():
+            if name in growing:
+                writer.create_dataset(name, shape=(0, ), maxshape=(None, ), dtype=data[name].dtype, chunks=(1024, ))
+            elif isinstance(item, h5py.Dataset) and item.shape is not None:
+                writer.create_dataset(name, data=item[()], dtype=item.dtype)
+    writer.swmr_mode = True
+
+    obj = LiveDynRoutData()
+    obj.openBehavData(live_filepath)
+    try:
+        nFrames = data["frameIntervals"].size
+        for frame in range(3000, nFrames, 3000):
+            write_growing_session(writer, data, frame)
+            obj.update()
+        write_growing_session(writer, data, nFrames)
+        obj.update(final=True)
+    finally:
+        obj.close()
+        writer.close()
+
+    expected = bundled_session
+    for name in bundled_block_metrics:
+        np.testing.assert_allclose(np.array(getattr(obj, name), dtype=float),
+                                   np.array(getattr(expected, name), dtype=float), err_msg=name)
+    np.testing.assert_array_equal(obj.engagedTrials, expected.engagedTrials)
+    np.testing.assert_array_equal(obj.lickTimes, expected.lickTimes)
+    np.testing.assert_allclose(obj.responseTimes, expected.responseTimes)
+    np.testing.assert_allclose(
+        obj.cumulativeVolume,
+        np.concatenate(([0], np.cumsum(expected.rewardSize)))[np.cumsum(expected.trialRewarded)],
+    )
+    assert len(obj.lickRaster) == expected.nTrials
+    for row, st in zip(obj.lickRaster, expected.stimStartTimes):
+        lt = expected.lickTimes - st
+        np.testing.assert_allclose(row, lt[(lt >= -obj.preTime) & (lt <= obj.postTime)])